@@ -0,0 +1,4 @@
+from papper_auth_client.dependencies import TokenClaims, TokenVerifier
+from papper_auth_client.jwks import JWKSClient, VerificationKey
+
+__all__ = ["JWKSClient", "TokenClaims", "TokenVerifier", "VerificationKey"]
@@ -0,0 +1,67 @@
+import typing
+from dataclasses import dataclass
+
+import jwt
+from fastapi import Body, HTTPException, status
+
+from papper_auth_client.jwks import JWKSClient
+
+
+@dataclass(frozen=True, slots=True)
+class TokenClaims:
+    user_id: str
+    login: typing.Optional[str]
+    has_face_id: bool
+    exp: int
+
+
+class TokenVerifier:
+    """FastAPI dependency verifying auth-service access tokens locally.
+
+    Usage::
+
+        verifier = TokenVerifier("http://papper-auth-service:8000/personal/.well-known/jwks.json")
+
+        @router.post("/documents")
+        async def documents(claims: TokenClaims = Depends(verifier)):
+            ...
+
+    Like auth-service's own ``authentication_with_token`` it reads the token
+    from the ``access_token`` body field and answers 401 when it is invalid.
+    """
+
+    def __init__(self, jwks_url: str, **jwks_options):
+        self.jwks = JWKSClient(jwks_url, **jwks_options)
+
+    async def __call__(self, access_token: str = Body(..., embed=True)) -> TokenClaims:
+        try:
+            return await self.verify(access_token)
+        except jwt.exceptions.ExpiredSignatureError:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Token has expired",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        except jwt.exceptions.InvalidTokenError:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid token",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+
+    async def verify(self, token: str) -> TokenClaims:
+        kid = jwt.get_unverified_header(token).get("kid")
+        if kid is None:
+            raise jwt.exceptions.InvalidTokenError("Token has no key id")
+        key = await self.jwks.get_key(kid)
+        payload = jwt.decode(token, key.key, algorithms=[key.algorithm],
+                             options={"require": ["exp", "user_id"]})
+
+        if payload.get("type") != "access":
+            raise jwt.exceptions.InvalidTokenError("Expected access token")
+        return TokenClaims(
+            user_id=payload["user_id"],
+            login=payload.get("login"),
+            has_face_id=bool(payload.get("has_face_id")),
+            exp=payload["exp"],
+        )
@@ -0,0 +1,93 @@
+import asyncio
+import re
+import time
+import typing
+from dataclasses import dataclass
+
+import aiohttp
+import jwt
+
+
+@dataclass(frozen=True, slots=True)
+class VerificationKey:
+    kid: str
+    algorithm: str
+    key: typing.Any
+
+
+class JWKSClient:
+    """Fetches and caches the auth-service JWK Set.
+
+    The set is refetched when it is older than the server's ``max-age`` (or
+    ``cache_ttl`` without one), and when a token names a ``kid`` the cached set
+    does not contain - that is how a freshly rotated key shows up. Refetches
+    for unknown kids are limited to one per ``min_refresh_interval`` so a
+    stream of forged kids cannot turn into a stream of requests.
+    """
+
+    def __init__(self, url: str, cache_ttl: float = 300, min_refresh_interval: float = 30,
+                 timeout: float = 5):
+        self.url = url
+        self.cache_ttl = cache_ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self._keys: dict[str, VerificationKey] = {}
+        self._fetched_at = 0.0
+        self._expires_at = 0.0
+        self._etag: str | None = None
+        self._lock = asyncio.Lock()
+
+    async def get_key(self, kid: str) -> VerificationKey:
+        if time.monotonic() >= self._expires_at:
+            await self._refresh(force=True)
+        key = self._keys.get(kid)
+        if key is None:
+            await self._refresh(force=False)
+            key = self._keys.get(kid)
+        if key is None:
+            raise jwt.exceptions.InvalidTokenError("Unknown key id")
+        return key
+
+    async def _refresh(self, force: bool) -> None:
+        fetched_at = self._fetched_at
+        async with self._lock:
+            if self._fetched_at != fetched_at:
+                return  # someone else refreshed while we waited
+            if not force and time.monotonic() - self._fetched_at < self.min_refresh_interval:
+                return
+            try:
+                await self._fetch()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if not self._keys:
+                    raise
+                # keep verifying with the keys we have and try again a bit later
+                self._fetched_at = time.monotonic()
+                self._expires_at = self._fetched_at + self.min_refresh_interval
+
+    async def _fetch(self) -> None:
+        headers = {"If-None-Match": self._etag} if self._etag else {}
+        async with aiohttp.ClientSession(timeout=self.timeout) as session:
+            async with session.get(self.url, headers=headers) as response:
+                if response.status != 304:
+                    response.raise_for_status()
+                    self._keys = self._parse(await response.json())
+                    self._etag = response.headers.get("ETag")
+                now = time.monotonic()
+                self._fetched_at = now
+                self._expires_at = now + self._max_age(response.headers.get("Cache-Control"))
+
+    def _max_age(self, cache_control: str | None) -> float:
+        match = re.search(r"max-age=(\d+)", cache_control or "")
+        return float(match.group(1)) if match else self.cache_ttl
+
+    @staticmethod
+    def _parse(jwks: dict[str, typing.Any]) -> dict[str, VerificationKey]:
+        keys = {}
+        for data in jwks.get("keys", []):
+            if data.get("use", "sig") != "sig" or "kid" not in data or "alg" not in data:
+                continue
+            try:
+                keys[data["kid"]] = VerificationKey(data["kid"], data["alg"], jwt.PyJWK(data).key)
+            except jwt.exceptions.PyJWKError:
+                continue  # an algorithm this client cannot handle, skip just that key
+        return keys
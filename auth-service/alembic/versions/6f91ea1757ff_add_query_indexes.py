@@ -0,0 +1,35 @@
+"""Add indexes for secrets listing and users.used_secret
+
+Revision ID: 6f91ea1757ff
+Revises: 1d24d7785267
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6f91ea1757ff'
+down_revision: Union[str, None] = '1d24d7785267'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # keyset pagination of /personal/secrets orders and seeks by (created_at, secret)
+    op.create_index('ix_secrets_created_at_secret', 'secrets', ['created_at', 'secret'], unique=False)
+    # the same for the common "unused secrets only" listing, which stays small as secrets get used
+    op.create_index('ix_secrets_unused_created_at_secret', 'secrets', ['created_at', 'secret'], unique=False,
+                    postgresql_where=sa.text('is_used = false'))
+    # users -> secrets FK, used by joins and by deletes/updates on secrets
+    op.create_index('ix_users_used_secret', 'users', ['used_secret'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_users_used_secret', table_name='users')
+    op.drop_index('ix_secrets_unused_created_at_secret', table_name='secrets',
+                  postgresql_where=sa.text('is_used = false'))
+    op.drop_index('ix_secrets_created_at_secret', table_name='secrets')
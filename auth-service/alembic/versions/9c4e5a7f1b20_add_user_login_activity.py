@@ -0,0 +1,30 @@
+"""Add users login activity columns
+
+Revision ID: 9c4e5a7f1b20
+Revises: 3b7d0c2e9a41
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9c4e5a7f1b20'
+down_revision: Union[str, None] = '3b7d0c2e9a41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('last_login_at', sa.DateTime(timezone=True), nullable=True))
+    op.add_column('users', sa.Column('last_refresh_at', sa.DateTime(timezone=True), nullable=True))
+    op.add_column('users', sa.Column('failed_login_count', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'failed_login_count')
+    op.drop_column('users', 'last_refresh_at')
+    op.drop_column('users', 'last_login_at')
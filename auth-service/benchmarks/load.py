@@ -0,0 +1,171 @@
+"""In-process load test of the auth endpoints.
+
+Drives ``main.app`` through httpx's ASGI transport (no network, no uvicorn)
+with ``--concurrency`` clients and reports requests per second and latency
+percentiles per endpoint. Run from auth-service/ with the service
+environment loaded and the schema migrated (``alembic upgrade head``):
+
+    PYTHONPATH=src python benchmarks/load.py [--requests 2000] [--concurrency 32] [--save-baseline]
+
+Only a local Postgres works as the database: registration and the secrets
+import rely on Postgres-only SQL. The users and secrets the run creates are
+deleted afterwards unless ``--keep-data`` is given. The login rate limiter is
+off unless LOGIN_RATE_LIMIT__ENABLED is set. Results are written to
+benchmarks/results/ and compared with benchmarks/baseline-load.json when it
+exists, see report.py.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import typing
+import uuid
+
+# every simulated client logs in over and over from one address, which is what the limiter exists to stop;
+# set before config is imported
+os.environ.setdefault("LOGIN_RATE_LIMIT__ENABLED", "false")
+
+import httpx
+from sqlalchemy import delete, select
+
+import report
+from auth import bulk
+from config import settings
+from main import app
+from repositories import models
+from repositories.postgres_repository import Session, UnitOfWork
+
+PASSWORD = "correct horse battery staple"
+ENDPOINTS = ["registration", "token", "refresh", "user"]
+
+
+class Client:
+    """One simulated client: a registered user and the latest tokens it got."""
+
+    def __init__(self, http: httpx.AsyncClient, login: str):
+        self.http = http
+        self.login = login
+        self.tokens: dict = {}
+
+    async def post(self, path: str, **kwargs) -> httpx.Response:
+        response = await self.http.post(path, **kwargs)
+        if response.status_code != 200:
+            raise RuntimeError(f"{path}: {response.status_code} {response.text}")
+        return response
+
+    async def register(self, secret: str, login: str) -> None:
+        await self.post("/personal/registration", json={"secret": secret, "login": login, "password": PASSWORD,
+                                                        "name": "bench", "surname": "bench"})
+
+    async def log_in(self) -> None:
+        self.tokens = (await self.post("/personal/token", json={"login": self.login, "password": PASSWORD})).json()
+
+    async def refresh(self) -> None:
+        # refresh tokens are single-use, every client follows its own rotation chain
+        self.tokens = (await self.post("/personal/refresh",
+                                       json={"refresh_token": self.tokens["refresh_token"]})).json()
+
+    async def user(self) -> None:
+        await self.post("/personal/user", json={"access_token": self.tokens["access_token"]})
+
+
+async def drive(clients: list[Client], requests: int,
+                request: typing.Callable[[Client, int], typing.Awaitable]) -> dict:
+    latencies: list[float] = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker(client: Client):
+        nonlocal errors
+        for number in counter:
+            started = time.perf_counter()
+            try:
+                await request(client, number)
+            except RuntimeError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(client) for client in clients))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        **report.latency_summary(latencies, unit="ms"),
+        "requests": len(latencies),
+        "errors": errors,
+    }
+
+
+async def clean_up(tag: str) -> None:
+    async with Session() as session:
+        users = select(models.User.user_id).where(models.User.login.like(f"{tag}-%"))
+        await session.execute(delete(models.RevokedToken).where(models.RevokedToken.user_id.in_(users)))
+        await session.execute(delete(models.User).where(models.User.login.like(f"{tag}-%")))
+        await session.execute(delete(models.Secret).where(models.Secret.created_by == tag))
+        await session.commit()
+
+
+async def run(endpoints: list[str], requests: int, concurrency: int, keep_data: bool) -> dict:
+    tag = f"bench-{uuid.uuid4().hex[:8]}"
+    secrets = bulk.generate_secrets(concurrency + requests)
+    results = {}
+
+    async with app.router.lifespan_context(app):
+        async with Session() as session:
+            await bulk.import_secrets(UnitOfWork(session), ((secret, tag) for secret in secrets))
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+            try:
+                clients = [Client(http, f"{tag}-{number}") for number in range(concurrency)]
+                for client, secret in zip(clients, secrets):
+                    await client.register(secret, client.login)
+                await asyncio.gather(*(client.log_in() for client in clients))
+                registration_secrets = secrets[concurrency:]
+
+                cases = {
+                    "registration": ("POST /personal/registration", lambda client, number: client.register(
+                        registration_secrets[number], f"{tag}-r{number}")),
+                    "token": ("POST /personal/token", lambda client, number: client.log_in()),
+                    "refresh": ("POST /personal/refresh", lambda client, number: client.refresh()),
+                    "user": ("POST /personal/user", lambda client, number: client.user()),
+                }
+                print(f"{'endpoint':<32}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+                for endpoint in endpoints:
+                    name, request = cases[endpoint]
+                    result = results[name] = await drive(clients, requests, request)
+                    print(f"{name:<32}{result['requests_per_second']:>10,.0f}{result['p50_ms']:>10.1f}"
+                          f"{result['p95_ms']:>10.1f}{result['p99_ms']:>10.1f}{result['errors']:>8}")
+            finally:
+                if not keep_data:
+                    await clean_up(tag)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=32, help="simultaneous clients")
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=ENDPOINTS)
+    parser.add_argument("--keep-data", action="store_true", help="leave the created users and secrets in place")
+    report.add_arguments(parser)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.endpoints, args.requests, args.concurrency, args.keep_data))
+    parameters = {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "password_hashing": settings.password_hashing.model_dump(),
+        "crypto_pool": settings.crypto_pool.model_dump(),
+        "db_pool": settings.db_pool.model_dump(),
+        "user_cache": settings.user_cache.enabled,
+        "replicas": len(settings.db_replicas.urls),
+        "login_rate_limit": settings.login_rate_limit.enabled,
+    }
+    path = report.save("load", results, parameters, args.save_baseline)
+    print(f"\nSaved {path}")
+    sys.exit(report.check_against_baseline(path, args.baseline or report.default_baseline("load"), args.tolerance))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Micro-benchmarks of the auth hot path: token signing and verification,
+password hashing and the repository methods behind the endpoints.
+
+Run from auth-service/ with the service environment loaded and the schema
+migrated (``alembic upgrade head``):
+
+    PYTHONPATH=src python benchmarks/micro.py [--seconds 2] [--save-baseline]
+
+Each case is awaited back to back on one event loop, so the numbers are
+per-call latencies without contention; load.py measures under concurrency.
+Results are written to benchmarks/results/ and compared with
+benchmarks/baseline-micro.json when it exists, see report.py.
+"""
+import argparse
+import asyncio
+import sys
+import time
+import typing
+import uuid
+from datetime import timedelta
+
+from sqlalchemy import delete
+
+import report
+from auth import passwords, utils
+from auth.executor import hashing_executor, signing_executor
+from auth.keys import key_manager
+from config import settings
+from repositories import models
+from repositories.postgres_repository import Session, SecretRepository, UnitOfWork, UserRepository, engine
+
+PASSWORD = "correct horse battery staple"
+
+
+async def measure(fn: typing.Callable[[], typing.Awaitable], seconds: float) -> dict:
+    latencies = []
+    started = time.perf_counter()
+    deadline = started + seconds
+    finished = started
+    while finished < deadline:
+        call_started = time.perf_counter()
+        await fn()
+        finished = time.perf_counter()
+        latencies.append(finished - call_started)
+    return {
+        "ops_per_second": round(len(latencies) / (finished - started), 1),
+        **report.latency_summary(latencies, unit="us"),
+        "calls": len(latencies),
+    }
+
+
+async def create_user() -> models.User:
+    user = models.User(user_id=str(uuid.uuid4()), login=f"bench-{uuid.uuid4().hex[:12]}",
+                       password=await utils.hash_password(PASSWORD), name="bench", surname="bench")
+    async with Session() as session:
+        uow = UnitOfWork(session)
+        await uow.users.add(user)
+        await uow.commit()
+    return user
+
+
+async def delete_user(user: models.User) -> None:
+    async with Session() as session:
+        await session.execute(delete(models.User).where(models.User.user_id == user.user_id))
+        await session.commit()
+
+
+async def run(seconds: float) -> dict:
+    key_manager.load()
+    user = await create_user()
+    tokens = await utils.get_access_and_refresh_tokens(user)
+    token_cache = utils.token_cache
+
+    async def decode_uncached():
+        utils.token_cache = None
+        try:
+            await utils.decode_token(tokens.access_token)
+        finally:
+            utils.token_cache = token_cache
+
+    async def user_get():
+        async with Session() as session:
+            await UserRepository(session).get(user.user_id)
+
+    async def user_get_by_login():
+        async with Session() as session:
+            await UserRepository(session).get_user_by_login(user.login)
+
+    async def secrets_page():
+        async with Session() as session:
+            await SecretRepository(session).get_secrets(limit=100)
+
+    cases = {
+        "create_token": lambda: utils.create_token({"user_id": user.user_id, "type": "access"},
+                                                   expires_delta=timedelta(minutes=5)),
+        "get_access_and_refresh_tokens": lambda: utils.get_access_and_refresh_tokens(user),
+        "decode_token (uncached)": decode_uncached,
+        "decode_token (cached)": lambda: utils.decode_token(tokens.access_token),
+        "hash_password": lambda: utils.hash_password(PASSWORD),
+        "verify_password": lambda: hashing_executor.run(passwords.verify_password, PASSWORD, user.password),
+        "UserRepository.get": user_get,
+        "UserRepository.get_user_by_login": user_get_by_login,
+        "SecretRepository.get_secrets (100)": secrets_page,
+    }
+
+    results = {}
+    try:
+        print(f"{'case':<40}{'ops/s':>12}{'p50 us':>12}{'p99 us':>12}")
+        for name, case in cases.items():
+            await case()  # warm up: executors, pool connections, prepared statements
+            results[name] = await measure(case, seconds)
+            print(f"{name:<40}{results[name]['ops_per_second']:>12,.0f}"
+                  f"{results[name]['p50_us']:>12,.1f}{results[name]['p99_us']:>12,.1f}")
+    finally:
+        await delete_user(user)
+        signing_executor.shutdown()
+        hashing_executor.shutdown()
+        await engine.dispose()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=2.0, help="time spent on each case")
+    report.add_arguments(parser)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.seconds))
+    parameters = {
+        "seconds": args.seconds,
+        "jwt_algorithm": key_manager.signing_key.algorithm,
+        "password_hashing": settings.password_hashing.model_dump(),
+        "crypto_pool": settings.crypto_pool.model_dump(),
+        "user_cache": settings.user_cache.enabled,
+    }
+    path = report.save("micro", results, parameters, args.save_baseline)
+    print(f"\nSaved {path}")
+    sys.exit(report.check_against_baseline(path, args.baseline or report.default_baseline("micro"), args.tolerance))
+
+
+if __name__ == "__main__":
+    main()
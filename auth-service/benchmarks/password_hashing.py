@@ -0,0 +1,55 @@
+"""Logins per second per core for candidate password hashing costs.
+
+Run from auth-service/ with the service environment loaded (the same .env
+the app uses):
+
+    PYTHONPATH=src python benchmarks/password_hashing.py [--seconds 3]
+
+Each row verifies one password in a loop on a single thread, which is what a
+login costs one crypto worker. Multiply by CRYPTO_POOL__MAX_WORKERS (or the
+cores given to hashing) for the per-instance ceiling.
+"""
+import argparse
+import time
+
+from auth import passwords
+from config import PasswordHashing, settings
+
+CANDIDATES = [
+    PasswordHashing(algorithm="scrypt", scrypt_n=2 ** 13),
+    PasswordHashing(algorithm="scrypt", scrypt_n=2 ** 14),
+    PasswordHashing(algorithm="scrypt", scrypt_n=2 ** 15),
+    PasswordHashing(algorithm="scrypt", scrypt_n=2 ** 16),
+    PasswordHashing(algorithm="pbkdf2_sha256", pbkdf2_iterations=100_000),
+    PasswordHashing(algorithm="pbkdf2_sha256", pbkdf2_iterations=300_000),
+    PasswordHashing(algorithm="pbkdf2_sha256", pbkdf2_iterations=600_000),
+]
+
+
+def logins_per_second(hashed: str, seconds: float) -> tuple[float, float]:
+    done = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds or done < 3:
+        passwords.verify_password("correct horse battery staple", hashed)
+        done += 1
+    elapsed = time.perf_counter() - started
+    return done / elapsed, elapsed / done * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=3.0, help="time spent on each setting")
+    args = parser.parse_args()
+
+    print(f"{'setting':<40}{'logins/s/core':>16}{'ms/login':>12}")
+    for config in CANDIDATES:
+        hashed = passwords.hash_password("correct horse battery staple", config)
+        rate, latency = logins_per_second(hashed, args.seconds)
+        label = hashed.rsplit("$", 2)[0]
+        if not passwords.needs_rehash(hashed, settings.password_hashing):
+            label += " (current)"
+        print(f"{label:<40}{rate:>16,.1f}{latency:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
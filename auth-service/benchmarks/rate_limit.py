@@ -0,0 +1,63 @@
+"""Per-request cost of the login rate limiter.
+
+Run from auth-service/ with the service environment loaded:
+
+    PYTHONPATH=src python benchmarks/rate_limit.py [--requests 200000]
+
+Measures ``LoginRateLimiter.check`` (two bucket updates) for a few hot keys,
+for a stream of always-new keys that keeps the store at ``max_keys`` and
+evicting, and one ``InMemoryRateLimitStore.hit`` on its own.
+"""
+import argparse
+import asyncio
+import time
+
+from starlette.requests import Request
+
+from auth.rate_limit import InMemoryRateLimitStore, LoginRateLimiter
+from config import LoginRateLimit
+
+
+def make_request(ip: str) -> Request:
+    return Request({"type": "http", "method": "POST", "path": "/personal/token", "headers": [],
+                    "client": (ip, 40000)})
+
+
+async def microseconds_per_call(fn, calls: int) -> float:
+    started = time.perf_counter()
+    for number in range(calls):
+        await fn(number)
+    return (time.perf_counter() - started) / calls * 1e6
+
+
+async def run(requests: int, max_keys: int):
+    # high limits so the measured path is the usual "allowed" one
+    config = LoginRateLimit(per_login_burst=10 ** 9, per_ip_burst=10 ** 9, max_keys=max_keys)
+
+    store = InMemoryRateLimitStore(max_keys)
+    hot = LoginRateLimiter(store, config)
+    hot_requests = [make_request(f"10.0.0.{number}") for number in range(16)]
+    hot_check = await microseconds_per_call(lambda n: hot.check(hot_requests[n % 16], f"user{n % 16}"), requests)
+
+    store = InMemoryRateLimitStore(max_keys)
+    churn = LoginRateLimiter(store, config)
+    request = make_request("10.0.0.1")
+    churn_check = await microseconds_per_call(lambda n: churn.check(request, f"user{n}"), requests)
+
+    hit = await microseconds_per_call(lambda n: store.hit("login:vasya", 10, 1.0), requests)
+
+    print(f"check, 16 hot clients      {hot_check:6.2f} us")
+    print(f"check, new login each time {churn_check:6.2f} us   ({len(store):,} keys kept, max {max_keys:,})")
+    print(f"store.hit                  {hit:6.2f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200_000)
+    parser.add_argument("--max-keys", type=int, default=100_000)
+    args = parser.parse_args()
+    asyncio.run(run(args.requests, args.max_keys))
+
+
+if __name__ == "__main__":
+    main()
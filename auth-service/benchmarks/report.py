@@ -0,0 +1,129 @@
+"""Result files shared by micro.py and load.py, and comparison against a baseline.
+
+Every run writes ``benchmarks/results/<name>-<timestamp>.json``; a result
+becomes the baseline by copying it (or passing ``--save-baseline``):
+
+    python benchmarks/report.py compare benchmarks/results/load-....json [--baseline benchmarks/baseline-load.json]
+
+The comparison fails (exit status 1) when a throughput drops or a p99 grows
+by more than ``--tolerance`` (15% by default). Numbers are only comparable
+between runs on the same machine and database.
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+BENCHMARKS_DIR = Path(__file__).parent
+RESULTS_DIR = BENCHMARKS_DIR / "results"
+
+# metric -> True when higher is better
+METRICS = {
+    "ops_per_second": True,
+    "requests_per_second": True,
+    "p99_ms": False,
+    "p99_us": False,
+}
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def latency_summary(seconds: list[float], unit: str = "ms") -> dict:
+    scale = 1e3 if unit == "ms" else 1e6
+    values = sorted(value * scale for value in seconds)
+    return {f"p{p}_{unit}": round(percentile(values, p / 100), 3) for p in (50, 95, 99)}
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=BENCHMARKS_DIR, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save(name: str, results: dict, parameters: dict, save_baseline: bool = False) -> Path:
+    document = {
+        "benchmark": name,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "parameters": parameters,
+        "results": results,
+    }
+    RESULTS_DIR.mkdir(exist_ok=True)
+    path = RESULTS_DIR / f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    path.write_text(json.dumps(document, indent=2))
+    if save_baseline:
+        default_baseline(name).write_text(json.dumps(document, indent=2))
+    return path
+
+
+def default_baseline(name: str) -> Path:
+    return BENCHMARKS_DIR / f"baseline-{name}.json"
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Prints a current/baseline table and returns the regressions found."""
+    regressions = []
+    print(f"{'benchmark':<40}{'metric':<22}{'baseline':>12}{'current':>12}{'change':>9}")
+    for case, values in current["results"].items():
+        previous = baseline["results"].get(case)
+        if previous is None:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            if metric not in values or not previous.get(metric):
+                continue
+            change = values[metric] / previous[metric] - 1
+            regressed = change < -tolerance if higher_is_better else change > tolerance
+            print(f"{case:<40}{metric:<22}{previous[metric]:>12,.2f}{values[metric]:>12,.2f}{change:>+8.0%}"
+                  + ("  REGRESSION" if regressed else ""))
+            if regressed:
+                regressions.append(f"{case} {metric}: {previous[metric]:,.2f} -> {values[metric]:,.2f}")
+    return regressions
+
+
+def check_against_baseline(path: Path, baseline_path: Path, tolerance: float) -> int:
+    if not baseline_path.exists():
+        print(f"No baseline at {baseline_path}, nothing to compare", file=sys.stderr)
+        return 0
+    regressions = compare(json.loads(path.read_text()), json.loads(baseline_path.read_text()), tolerance)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) against {baseline_path}:", file=sys.stderr)
+        for regression in regressions:
+            print(f"  {regression}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def add_arguments(parser: argparse.ArgumentParser, saving: bool = True) -> None:
+    parser.add_argument("--baseline", type=Path, help="baseline to compare with, baseline-<benchmark>.json by default")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative slowdown, 0.15 by default")
+    if saving:
+        parser.add_argument("--save-baseline", action="store_true", help="also store this run as the default baseline")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    compare_parser = subparsers.add_parser("compare", help="compare a result file with a baseline")
+    compare_parser.add_argument("result", type=Path)
+    add_arguments(compare_parser, saving=False)
+    args = parser.parse_args()
+
+    result = json.loads(args.result.read_text())
+    sys.exit(check_against_baseline(args.result, args.baseline or default_baseline(result["benchmark"]),
+                                    args.tolerance))
+
+
+if __name__ == "__main__":
+    main()
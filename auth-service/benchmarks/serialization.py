@@ -0,0 +1,103 @@
+"""Response serialization cost of /personal/user and /personal/secrets, before and after
+explicit response models with ORJSONResponse.
+
+Run from auth-service/ with the service environment loaded:
+
+    PYTHONPATH=src python benchmarks/serialization.py [--seconds 2]
+
+"before" is what the endpoints used to do: ``jsonable_encoder`` over ORM
+``__dict__`` and the stdlib-json ``JSONResponse``. "after" runs FastAPI's own
+response path for the routes (validation into the response model,
+pydantic-core serialization) and renders with ``ORJSONResponse``. ORM rows
+are built in memory, no database is needed.
+"""
+import argparse
+import asyncio
+import time
+import uuid
+from datetime import datetime, timezone
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+
+from auth import schemas
+from auth.router import auth_router
+from repositories import models
+
+
+def response_field(path: str):
+    return next(route.response_field for route in auth_router.routes if route.path == path)
+
+
+def make_user() -> models.User:
+    return models.User(user_id=str(uuid.uuid4()), login="vasya", password="scrypt$n=16384,r=8,p=1$salt$hash",
+                       name="Vasya", surname="Pupkin", has_face_id=True, is_active=True,
+                       used_secret=str(uuid.uuid4()), created_at=datetime.now(timezone.utc), token_version=0)
+
+
+def make_secrets(count: int) -> list[models.Secret]:
+    now = datetime.now(timezone.utc)
+    return [models.Secret(secret=str(uuid.uuid4()), created_by="vasya", used_by=str(uuid.uuid4()), is_used=True,
+                          created_at=now) for _ in range(count)]
+
+
+def per_second(fn, seconds: float) -> float:
+    done = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        fn()
+        done += 1
+    return done / (time.perf_counter() - started)
+
+
+async def per_second_async(fn, seconds: float) -> float:
+    done = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        await fn()
+        done += 1
+    return done / (time.perf_counter() - started)
+
+
+async def run(seconds: float):
+    user = make_user()
+    user_field = response_field("/personal/user")
+    page_field = response_field("/personal/secrets")
+
+    def user_before():
+        return JSONResponse(jsonable_encoder(user.__dict__)).body
+
+    async def user_after():
+        return ORJSONResponse(await serialize_response(field=user_field, response_content=user)).body
+
+    print(f"{'case':<28}{'before/s':>12}{'after/s':>12}{'speedup':>10}")
+    before = per_second(user_before, seconds)
+    after = await per_second_async(user_after, seconds)
+    print(f"{'/personal/user':<28}{before:>12,.0f}{after:>12,.0f}{after / before:>9.1f}x")
+
+    for count in (100, 1000, 10_000):
+        secrets = make_secrets(count)
+
+        def page_before():
+            return JSONResponse(jsonable_encoder({"items": [secret.__dict__ for secret in secrets],
+                                                  "next_cursor": None})).body
+
+        async def page_after():
+            page = schemas.SecretsPage(items=secrets, next_cursor=None)
+            return ORJSONResponse(await serialize_response(field=page_field, response_content=page)).body
+
+        before = per_second(page_before, seconds)
+        after = await per_second_async(page_after, seconds)
+        print(f"{f'/personal/secrets ({count})':<28}{before:>12,.1f}{after:>12,.1f}{after / before:>9.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=2.0, help="time spent on each measurement")
+    args = parser.parse_args()
+    asyncio.run(run(args.seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Sign/verify throughput of the JWT algorithms auth-service can use.
+
+Run from auth-service/:
+
+    python benchmarks/token_algorithms.py [--seconds 2] [--verifies-per-sign 1,5,20,100]
+
+Keys are generated in memory, so no certs or settings are needed.
+
+Signing is faster with ES256/EdDSA, verifying is faster with RS256, so
+which one costs less CPU depends on how many verifications each token gets.
+A login signs two tokens; every request carrying an access token verifies
+it, here (once per worker with the token cache) and in each service that
+checks it locally with auth-client, which has no claims cache. The second
+table weighs both: signs per second a core sustains when every sign comes
+with that many verifies.
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+
+
+def generate_keys() -> dict:
+    return {
+        "RS256": rsa.generate_private_key(public_exponent=65537, key_size=2048),
+        "ES256": ec.generate_private_key(ec.SECP256R1()),
+        "EdDSA": ed25519.Ed25519PrivateKey.generate(),
+    }
+
+
+def ops_per_second(fn, seconds: float) -> float:
+    fn()  # warm-up
+    done = 0
+    started = time.perf_counter()
+    deadline = started + seconds
+    while time.perf_counter() < deadline:
+        for _ in range(50):
+            fn()
+        done += 50
+    return done / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=2.0, help="time spent on each measurement")
+    parser.add_argument("--verifies-per-sign", default="1,5,20,100",
+                        help="comma-separated sign:verify ratios to weigh the results at")
+    args = parser.parse_args()
+    ratios = [float(ratio) for ratio in args.verifies_per_sign.split(",")]
+
+    payload = {
+        "user_id": "17374954-9f59-4bdd-873f-9d30b95549bf",
+        "login": "vasya",
+        "has_face_id": False,
+        "type": "access",
+        "exp": datetime.utcnow() + timedelta(minutes=300),
+    }
+
+    results = {}
+    print(f"{'algorithm':<10}{'sign ops/s':>14}{'verify ops/s':>14}{'token bytes':>14}")
+    for algorithm, private_key in generate_keys().items():
+        public_key = private_key.public_key()
+        token = jwt.encode(payload, private_key, algorithm=algorithm)
+
+        sign = ops_per_second(lambda: jwt.encode(payload, private_key, algorithm=algorithm), args.seconds)
+        verify = ops_per_second(lambda: jwt.decode(token, public_key, algorithms=[algorithm]), args.seconds)
+        results[algorithm] = sign, verify
+        print(f"{algorithm:<10}{sign:>14,.0f}{verify:>14,.0f}{len(token):>14}")
+
+    print()
+    print(f"{'algorithm':<10}" + "".join(f"{f'signs/s @1:{ratio:g}':>16}" for ratio in ratios))
+    for algorithm, (sign, verify) in results.items():
+        mixed = [1 / (1 / sign + ratio / verify) for ratio in ratios]
+        print(f"{algorithm:<10}" + "".join(f"{value:>16,.0f}" for value in mixed))
+
+
+if __name__ == "__main__":
+    main()
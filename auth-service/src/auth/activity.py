@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import typing
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+import metrics
+from config import settings
+from repositories.postgres_repository import Session, UnitOfWork
+
+logger = logging.getLogger(__name__)
+
+ACTIVITY_FLUSHED = metrics.Counter("auth_activity_flushed_users_total", "Users updated by activity flushes")
+
+
+@dataclass(slots=True)
+class _Activity:
+    last_login_at: typing.Optional[datetime] = None
+    last_refresh_at: typing.Optional[datetime] = None
+    failed_logins: int = 0  # since the last successful login in this batch, or in total without one
+    login_succeeded: bool = False
+
+    def merge_newer(self, newer: "_Activity") -> None:
+        if newer.last_login_at is not None:
+            self.last_login_at = max(self.last_login_at or newer.last_login_at, newer.last_login_at)
+        if newer.last_refresh_at is not None:
+            self.last_refresh_at = max(self.last_refresh_at or newer.last_refresh_at, newer.last_refresh_at)
+        self.failed_logins = newer.failed_logins if newer.login_succeeded else self.failed_logins + newer.failed_logins
+        self.login_succeeded = self.login_succeeded or newer.login_succeeded
+
+
+class ActivityRecorder:
+    """Write-behind recording of logins, refreshes and failed logins on ``users``.
+
+    Events only touch an in-memory dict, coalesced per user; a background task
+    writes them in batched ``UPDATE ... FROM (VALUES ...)`` statements every
+    ``flush_interval_seconds``, or sooner once ``max_pending`` users are waiting.
+    A failed flush is merged back and retried with the next one. ``close``
+    drains what is left on shutdown; a crash loses at most one interval.
+    """
+
+    def __init__(self, enabled: bool, flush_interval_seconds: float, max_pending: int, batch_size: int):
+        self.enabled = enabled
+        self.flush_interval_seconds = flush_interval_seconds
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self._pending: dict[str, _Activity] = {}
+        self._wakeup = asyncio.Event()
+        self._closing = False
+        self._task: typing.Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def login_succeeded(self, user_id: str) -> None:
+        self._record(user_id, _Activity(last_login_at=datetime.now(timezone.utc), login_succeeded=True))
+
+    def login_failed(self, user_id: str) -> None:
+        self._record(user_id, _Activity(failed_logins=1))
+
+    def refreshed(self, user_id: str) -> None:
+        self._record(user_id, _Activity(last_refresh_at=datetime.now(timezone.utc)))
+
+    def _record(self, user_id: str, activity: _Activity) -> None:
+        if not self.enabled:
+            return
+        pending = self._pending.get(user_id)
+        if pending is None:
+            self._pending[user_id] = activity
+            if len(self._pending) >= self.max_pending:
+                self._wakeup.set()
+        else:
+            pending.merge_newer(activity)
+
+    async def flush(self) -> int:
+        batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
+        rows = [(user_id, activity.last_login_at, activity.last_refresh_at, activity.failed_logins,
+                 activity.login_succeeded) for user_id, activity in batch.items()]
+        try:
+            async with Session() as session:
+                uow = UnitOfWork(session)
+                for start in range(0, len(rows), self.batch_size):
+                    await uow.users.record_activity(rows[start:start + self.batch_size])
+                await uow.commit()
+        except BaseException:
+            # put the batch back in front of whatever arrived meanwhile
+            for user_id, newer in self._pending.items():
+                older = batch.get(user_id)
+                if older is None:
+                    batch[user_id] = newer
+                else:
+                    older.merge_newer(newer)
+            self._pending = batch
+            raise
+        ACTIVITY_FLUSHED.inc(amount=len(rows))
+        return len(rows)
+
+    def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Flushing login activity failed, %d users pending", len(self._pending))
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._closing = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        try:
+            await self.flush()
+        except Exception:
+            # shutdown goes on regardless, the rest of the teardown must not depend on the database
+            logger.exception("Flushing login activity on shutdown failed, %d users not recorded", len(self._pending))
+
+
+activity_recorder = ActivityRecorder(**settings.activity.model_dump())
+
+metrics.CallbackMetric("auth_activity_pending_users", "Users with activity waiting to be flushed",
+                       lambda: len(activity_recorder))
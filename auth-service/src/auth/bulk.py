@@ -0,0 +1,285 @@
+import asyncio
+import codecs
+import csv
+import itertools
+import json
+import time
+import typing
+import uuid
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+from fastapi import UploadFile
+
+from auth import passwords
+from config import settings
+from repositories.postgres_repository import Session, UnitOfWork
+
+BATCH_SIZE = 10_000
+USER_BATCH_SIZE = 1_000  # users are committed batch by batch, this is also the resume granularity
+USER_FIELDS = ("login", "password", "name", "surname")
+
+
+@dataclass(slots=True)
+class ImportStats:
+    received: int = 0
+    inserted: int = 0
+    seconds: float = 0.0
+
+    @property
+    def skipped(self) -> int:
+        return self.received - self.inserted
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.received / self.seconds if self.seconds else 0.0
+
+
+def generate_secrets(count: int) -> list[str]:
+    return [str(uuid.uuid4()) for _ in range(count)]
+
+
+def _secret_row(number: int, row: list[str], created_by: str) -> typing.Optional[tuple[str, str]]:
+    if not row or not row[0].strip():
+        return None
+    try:
+        secret = str(uuid.UUID(row[0].strip()))
+    except ValueError:
+        if number == 1:
+            return None  # header
+        raise ValueError(f"Line {number}: {row[0]!r} is not a UUID")
+    return secret, (row[1].strip() if len(row) > 1 and row[1].strip() else created_by)
+
+
+def read_secrets_csv(lines: typing.Iterable[str], created_by: str) -> typing.Iterator[tuple[str, str]]:
+    """(secret, created_by) rows from a ``secret[,created_by]`` CSV, with or without a header."""
+    for number, row in enumerate(csv.reader(lines), start=1):
+        secret = _secret_row(number, row, created_by)
+        if secret is not None:
+            yield secret
+
+
+async def read_secrets_upload(file: UploadFile, created_by: str,
+                              chunk_size: int = 64 * 1024) -> typing.AsyncIterator[tuple[str, str]]:
+    """``read_secrets_csv`` for an upload, read chunk by chunk without blocking the event loop."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    number, tail = 0, ""
+    while True:
+        chunk = await file.read(chunk_size)
+        lines = (tail + decoder.decode(chunk, final=not chunk)).splitlines(keepends=True)
+        # the last line may continue in the next chunk
+        tail = lines.pop() if chunk and lines and not lines[-1].endswith("\n") else ""
+        for row in csv.reader(lines):
+            number += 1
+            secret = _secret_row(number, row, created_by)
+            if secret is not None:
+                yield secret
+        if not chunk:
+            return
+
+
+async def _batches(rows: typing.Union[typing.Iterable[tuple[str, str]], typing.AsyncIterable[tuple[str, str]]],
+                   size: int) -> typing.AsyncIterator[list[tuple[str, str]]]:
+    batch = []
+    if not isinstance(rows, typing.AsyncIterable):
+        rows = _aiter(rows)
+    async for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def _aiter(rows: typing.Iterable) -> typing.AsyncIterator:
+    for row in rows:
+        yield row
+
+
+async def import_secrets(uow: UnitOfWork,
+                         rows: typing.Union[typing.Iterable[tuple[str, str]], typing.AsyncIterable[tuple[str, str]]],
+                         batch_size: int = BATCH_SIZE) -> ImportStats:
+    """COPYs the rows in batches and commits them in one transaction; existing secrets are skipped."""
+    started = time.perf_counter()
+    received, inserted = await uow.secrets.add_many(_batches(rows, batch_size))
+    await uow.commit()
+    return ImportStats(received=received, inserted=inserted, seconds=time.perf_counter() - started)
+
+
+@dataclass(slots=True)
+class UserRow:
+    row: int
+    login: str
+    password: str
+    name: str
+    surname: str
+    secret: typing.Optional[str] = None
+
+
+@dataclass(slots=True)
+class RowError:
+    row: int
+    login: typing.Optional[str]
+    error: str
+
+
+@dataclass(slots=True)
+class UserImportStats:
+    received: int = 0
+    inserted: int = 0
+    failed: int = 0
+    last_row: int = 0  # rows up to this one are committed, resume with it as the offset
+    seconds: float = 0.0
+    writing_seconds: float = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.received / self.seconds if self.seconds else 0.0
+
+
+def _user_row(number: int, record: typing.Any) -> typing.Union[UserRow, RowError]:
+    if not isinstance(record, dict):
+        return RowError(number, None, "Row is not an object")
+    login = record.get("login") if isinstance(record.get("login"), str) else None
+    for name in USER_FIELDS:
+        if not isinstance(record.get(name), str) or not record[name]:
+            return RowError(number, login, f"Missing {name}")
+    secret = record.get("secret") or None
+    if secret is not None:
+        try:
+            secret = str(uuid.UUID(str(secret).strip()))
+        except ValueError:
+            return RowError(number, login, f"{secret!r} is not a UUID")
+    return UserRow(number, record["login"], record["password"], record["name"], record["surname"], secret)
+
+
+def read_users(lines: typing.Iterable[str], file_format: typing.Literal["csv", "ndjson"],
+               offset: int = 0) -> typing.Iterator[typing.Union[UserRow, RowError]]:
+    """Users from a ``login,password,name,surname[,secret]`` CSV with a header, or NDJSON objects with those keys.
+
+    Rows are numbered from 1, not counting the header and blank lines; the
+    first ``offset`` ones are skipped without being parsed.
+    """
+    if file_format == "csv":
+        records = csv.DictReader(lines)
+        missing = [name for name in USER_FIELDS if name not in (records.fieldnames or ())]
+        if missing:
+            raise ValueError(f"The header has no {', '.join(missing)} column")
+    else:
+        records = (line for line in lines if line.strip())
+    return _parse_users(records, file_format, offset)
+
+
+def _parse_users(records: typing.Iterable, file_format: str,
+                 offset: int) -> typing.Iterator[typing.Union[UserRow, RowError]]:
+    for number, record in enumerate(records, start=1):
+        if number <= offset:
+            continue
+        if file_format == "ndjson":
+            try:
+                record = json.loads(record)
+            except ValueError:
+                yield RowError(number, None, "Invalid JSON")
+                continue
+        yield _user_row(number, record)
+
+
+@dataclass(slots=True)
+class _UserBatch:
+    users: list[UserRow] = field(default_factory=list)
+    errors: list[RowError] = field(default_factory=list)
+    last_row: int = 0
+
+
+def _user_batches(rows: typing.Iterable[typing.Union[UserRow, RowError]], size: int) -> typing.Iterator[_UserBatch]:
+    batch, logins, secrets = _UserBatch(), set(), set()
+    for row in rows:
+        batch.last_row = row.row
+        if isinstance(row, RowError):
+            batch.errors.append(row)
+        elif row.login in logins:
+            batch.errors.append(RowError(row.row, row.login, "Duplicate login in the file"))
+        elif row.secret is not None and row.secret in secrets:
+            batch.errors.append(RowError(row.row, row.login, "Duplicate secret in the file"))
+        else:
+            batch.users.append(row)
+            logins.add(row.login)
+            if row.secret is not None:
+                secrets.add(row.secret)
+        if len(batch.users) + len(batch.errors) >= size:
+            yield batch
+            batch, logins, secrets = _UserBatch(), set(), set()
+    if batch.last_row:
+        yield batch
+
+
+async def _hash_passwords(pool: Executor, batch: _UserBatch, workers: int) -> list[str]:
+    plain = [user.password for user in batch.users]
+    chunk = max(1, -(-len(plain) // workers))
+    loop = asyncio.get_running_loop()
+    chunks = await asyncio.gather(*(
+        loop.run_in_executor(pool, passwords.hash_passwords, plain[start:start + chunk], settings.password_hashing)
+        for start in range(0, len(plain), chunk)
+    ))
+    return [hashed for hashes in chunks for hashed in hashes]
+
+
+async def _insert_users(batch: _UserBatch, hashes: list[str], created_by: str) -> tuple[int, list[RowError]]:
+    records, rows = [], {}
+    for user, hashed in zip(batch.users, hashes):
+        user_id = str(uuid.uuid4())
+        rows[user_id] = user
+        records.append((user_id, user.login, hashed, user.name, user.surname, user.secret or str(uuid.uuid4())))
+
+    inserted, rejected = set(), set()
+    if records:
+        async with Session() as session:
+            uow = UnitOfWork(session)
+            inserted, rejected = await uow.users.add_many(records, created_by)
+            await uow.commit()
+
+    errors = list(batch.errors)
+    for user_id, user in rows.items():
+        if user_id in rejected:
+            errors.append(RowError(user.row, user.login, "Secret is already used"))
+        elif user_id not in inserted:
+            errors.append(RowError(user.row, user.login, "Login already exists"))
+    errors.sort(key=lambda error: error.row)
+    return len(inserted), errors
+
+
+async def import_users(rows: typing.Iterable[typing.Union[UserRow, RowError]], created_by: str, workers: int,
+                       batch_size: int = USER_BATCH_SIZE
+                       ) -> typing.AsyncIterator[tuple[UserImportStats, list[RowError]]]:
+    """Hashes and inserts users batch by batch, committing each one; yields the running totals and failed rows.
+
+    The next batch is hashed by ``workers`` processes while the current one is
+    written, so no more than two batches are held in memory whatever the size
+    of the input.
+    """
+    stats = UserImportStats()
+    started = time.perf_counter()
+    pool = ProcessPoolExecutor(max_workers=workers)
+    hashing: typing.Optional[asyncio.Future] = None
+    try:
+        pending: typing.Optional[tuple[_UserBatch, asyncio.Future]] = None
+        for batch in itertools.chain(_user_batches(rows, batch_size), [None]):
+            if batch is not None:
+                hashing = asyncio.ensure_future(_hash_passwords(pool, batch, workers))
+            if pending is not None:
+                written, hashes = pending[0], await pending[1]
+                writing = time.perf_counter()
+                inserted, errors = await _insert_users(written, hashes, created_by)
+                stats.writing_seconds += time.perf_counter() - writing
+                stats.received += len(written.users) + len(written.errors)
+                stats.inserted += inserted
+                stats.failed += len(errors)
+                stats.last_row = written.last_row
+                stats.seconds = time.perf_counter() - started
+                yield stats, errors
+            pending = (batch, hashing) if batch is not None else None
+    finally:
+        if hashing is not None and not hashing.done():
+            hashing.cancel()
+        pool.shutdown(wait=True, cancel_futures=True)
@@ -5,9 +5,22 @@ from auth import utils
 from auth.schemas import RegistrationRequest, Secret
 
 
-async def authentication_with_token(access_token: str = Body(..., embed=True)):
+async def authentication_with_token(access_token: str = Body(..., embed=True)) -> utils.TokenClaims:
+    return await _decode_or_401(access_token, utils.TokenType.ACCESS)
+
+
+async def authentication_with_form_token(access_token: str = Form(...)) -> utils.TokenClaims:
+    # for form and file upload endpoints, which cannot take a JSON body
+    return await _decode_or_401(access_token, utils.TokenType.ACCESS)
+
+
+async def authentication_with_refresh_token(refresh_token: str = Body(..., embed=True)) -> utils.TokenClaims:
+    return await _decode_or_401(refresh_token, utils.TokenType.REFRESH)
+
+
+async def _decode_or_401(token: str, token_type: utils.TokenType) -> utils.TokenClaims:
     try:
-        return await utils.decode_access_token(access_token)
+        return await utils.decode_token(token, token_type)
 
     except jwt.exceptions.ExpiredSignatureError:
         raise HTTPException(
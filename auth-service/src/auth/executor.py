@@ -0,0 +1,66 @@
+import asyncio
+import typing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+from fastapi import HTTPException, status
+
+import metrics
+from config import settings
+
+
+class CryptoExecutor:
+    """Runs CPU-bound crypto work off the event loop.
+
+    At most ``max_workers`` jobs run at once and at most ``max_pending`` more
+    wait for a worker; anything beyond that is rejected with 503 instead of
+    growing the queue (and everyone's latency) without bound.
+    """
+
+    def __init__(self, max_workers: int, max_pending: int, use_processes: bool = False):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.use_processes = use_processes
+        self._pool: Executor | None = None
+        self._in_flight = 0  # only touched from the event loop thread
+
+    @property
+    def pool(self) -> Executor:
+        if self._pool is None:
+            if self.use_processes:
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="crypto")
+        return self._pool
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    async def run(self, fn: typing.Callable, *args):
+        if self._in_flight >= self.max_workers + self.max_pending:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server is busy, try again later",
+                headers={"Retry-After": "1"},
+            )
+        self._in_flight += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.pool, fn, *args)
+        finally:
+            self._in_flight -= 1
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+
+# signing needs the in-memory key objects, so it always runs in threads
+signing_executor = CryptoExecutor(settings.crypto_pool.max_workers, settings.crypto_pool.max_pending)
+hashing_executor = CryptoExecutor(settings.crypto_pool.max_workers, settings.crypto_pool.max_pending,
+                                  use_processes=settings.crypto_pool.hashing_executor == "process")
+
+metrics.CallbackMetric("crypto_executor_jobs", "Crypto jobs running or waiting for a worker", lambda: {
+    ("signing",): signing_executor.in_flight,
+    ("hashing",): hashing_executor.in_flight,
+}, ["executor"])
@@ -0,0 +1,183 @@
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import time
+import typing
+from dataclasses import dataclass, replace
+from pathlib import Path
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+
+from config import AuthJWT, settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, slots=True)
+class JWTKey:
+    kid: str
+    algorithm: str
+    public_key: typing.Any
+    private_key: typing.Any = None
+    retired_at: float | None = None
+
+
+RSA_ALGORITHMS = ("RS256", "RS384", "RS512", "PS256", "PS384", "PS512")
+EC_ALGORITHMS = {"secp256r1": "ES256", "secp384r1": "ES384", "secp521r1": "ES512"}
+
+
+def key_algorithm(public_key, configured: str | None = None) -> str:
+    if isinstance(public_key, ed25519.Ed25519PublicKey):
+        algorithm = "EdDSA"
+    elif isinstance(public_key, ec.EllipticCurvePublicKey):
+        if public_key.curve.name not in EC_ALGORITHMS:
+            raise ValueError(f"Unsupported EC curve {public_key.curve.name}")
+        algorithm = EC_ALGORITHMS[public_key.curve.name]
+    elif isinstance(public_key, rsa.RSAPublicKey):
+        if configured and configured not in RSA_ALGORITHMS:
+            raise ValueError(f"Configured algorithm {configured} does not match RSA key")
+        return configured or "RS256"
+    else:
+        raise ValueError(f"Unsupported key type {type(public_key).__name__}")
+    if configured and configured != algorithm:
+        raise ValueError(f"Configured algorithm {configured} does not match {algorithm} key")
+    return algorithm
+
+
+def key_id(public_key) -> str:
+    der = public_key.public_bytes(
+        serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    return base64.urlsafe_b64encode(hashlib.sha256(der).digest()[:12]).decode().rstrip("=")
+
+
+class KeyManager:
+    """Keeps parsed signing and verification keys in memory.
+
+    The active key is read from ``private_key_path`` (the public half is
+    derived from it). When ``load`` finds a different key there, the
+    previous one is retired:
+    it stops signing but keeps verifying until every token it could have
+    signed has expired. Public keys in ``retired_keys_dir`` are accepted for
+    verification as well, so a restart right after rotation does not
+    invalidate live tokens.
+    """
+
+    def __init__(self, config: AuthJWT):
+        self.config = config
+        self._signing_key: JWTKey | None = None
+        self._keys: dict[str, JWTKey] = {}
+        self._source: bytes | None = None
+        self._jwks: tuple[bytes, str] | None = None
+
+    @property
+    def max_token_lifetime(self) -> float:
+        return max(self.config.access_token_expire_minutes * 60,
+                   self.config.refresh_token_expire_hours * 3600)
+
+    @property
+    def signing_key(self) -> JWTKey:
+        if self._signing_key is None:
+            self.load()
+        return self._signing_key
+
+    def get_verification_key(self, kid: str | None, algorithm: str | None = None) -> JWTKey:
+        if self._signing_key is None:
+            self.load()
+        if kid is None:  # tokens issued before keys had ids
+            return self._key_for_algorithm(algorithm)
+        key = self._keys.get(kid)
+        if key is None:
+            raise jwt.exceptions.InvalidTokenError("Unknown key id")
+        return key
+
+    def has_key(self, kid: str | None) -> bool:
+        return kid in self._keys
+
+    def verification_keys(self) -> list[JWTKey]:
+        return list(self._keys.values())
+
+    def jwks(self) -> tuple[bytes, str]:
+        """The public keys as a serialized JWK Set, with an ETag for it."""
+        if self._signing_key is None:
+            self.load()
+        if self._jwks is None:
+            keys = []
+            for key in self._keys.values():
+                jwk = jwt.get_algorithm_by_name(key.algorithm).to_jwk(key.public_key, as_dict=True)
+                keys.append({**jwk, "kid": key.kid, "alg": key.algorithm, "use": "sig"})
+            body = json.dumps({"keys": keys}, separators=(",", ":")).encode()
+            self._jwks = body, '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        return self._jwks
+
+    def _key_for_algorithm(self, algorithm: str | None) -> JWTKey:
+        if algorithm is None or self._signing_key.algorithm == algorithm:
+            return self._signing_key
+        for key in self._keys.values():
+            if key.algorithm == algorithm:
+                return key
+        raise jwt.exceptions.InvalidAlgorithmError("The specified alg value is not allowed")
+
+    def load(self) -> None:
+        private_pem = self.config.private_key_path.read_bytes()
+        signing_key = self._signing_key
+        rotated = private_pem != self._source
+        if rotated:
+            private_key = serialization.load_pem_private_key(private_pem, password=None)
+            public_key = private_key.public_key()
+            signing_key = JWTKey(
+                kid=key_id(public_key),
+                algorithm=key_algorithm(public_key, self.config.algorithm),
+                public_key=public_key,
+                private_key=private_key,
+            )
+
+        now = time.time()
+        deadline = now - self.max_token_lifetime
+        keys = {key.kid: key for key in self._load_retired_keys()}
+        for key in self._keys.values():
+            if key.kid == signing_key.kid or key.kid in keys:
+                continue
+            if key.private_key is not None:  # the previous signing key
+                keys[key.kid] = replace(key, private_key=None, retired_at=now)
+            elif key.retired_at is not None and key.retired_at > deadline:
+                keys[key.kid] = key
+        keys[signing_key.kid] = signing_key
+
+        # swap references only, readers never see a half-built key set
+        self._keys = keys
+        self._signing_key = signing_key
+        self._source = private_pem
+        self._jwks = None
+        if rotated:
+            logger.info("Loaded signing key %s, %d verification keys", signing_key.kid, len(keys))
+
+    def _load_retired_keys(self) -> list[JWTKey]:
+        directory: Path = self.config.retired_keys_dir
+        if not directory.is_dir():
+            return []
+        keys = []
+        for path in sorted(directory.glob("*.pem")):
+            public_key = serialization.load_pem_public_key(path.read_bytes())
+            # keys on disk are accepted until they are removed from the directory
+            keys.append(JWTKey(kid=key_id(public_key), algorithm=key_algorithm(public_key), public_key=public_key))
+        return keys
+
+    def reload(self) -> None:
+        try:
+            self.load()
+        except Exception:
+            # keep serving with the keys we already have
+            logger.exception("Failed to reload signing keys")
+
+    async def run_periodic_reload(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            self.reload()
+
+
+key_manager = KeyManager(settings.auth_jwt)
@@ -0,0 +1,75 @@
+"""Password hashes in a self-describing ``<algorithm>$<params>$<salt>$<hash>`` format.
+
+Hashes written before this format existed are bare unsalted sha256 hex
+digests; they still verify, and ``needs_rehash`` reports them so they get
+upgraded on the next successful login.
+"""
+import base64
+import hashlib
+import hmac
+import os
+
+from config import PasswordHashing
+
+SALT_BYTES = 16
+HASH_BYTES = 32
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.b64encode(data).decode().rstrip("=")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.b64decode(data + "=" * (-len(data) % 4))
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                          maxmem=128 * r * (n + p) + 1024 * 1024, dklen=HASH_BYTES)
+
+
+def _pbkdf2(password: str, salt: bytes, iterations: int) -> bytes:
+    return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations, dklen=HASH_BYTES)
+
+
+def _parameters(config: PasswordHashing) -> str:
+    if config.algorithm == "scrypt":
+        return f"n={config.scrypt_n},r={config.scrypt_r},p={config.scrypt_p}"
+    return f"i={config.pbkdf2_iterations}"
+
+
+def hash_password(password: str, config: PasswordHashing) -> str:
+    salt = os.urandom(SALT_BYTES)
+    if config.algorithm == "scrypt":
+        digest = _scrypt(password, salt, config.scrypt_n, config.scrypt_r, config.scrypt_p)
+    else:
+        digest = _pbkdf2(password, salt, config.pbkdf2_iterations)
+    return f"{config.algorithm}${_parameters(config)}${_b64encode(salt)}${_b64encode(digest)}"
+
+
+def hash_passwords(passwords: list[str], config: PasswordHashing) -> list[str]:
+    # one process pool job per chunk rather than per password, for auth.bulk
+    return [hash_password(password, config) for password in passwords]
+
+
+def verify_password(password: str, hashed_password: str) -> bool:
+    if "$" not in hashed_password:  # legacy unsalted sha256
+        return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), hashed_password)
+
+    try:
+        algorithm, parameters, salt, expected = hashed_password.split("$")
+        params = dict(item.split("=") for item in parameters.split(","))
+        salt = _b64decode(salt)
+        if algorithm == "scrypt":
+            digest = _scrypt(password, salt, int(params["n"]), int(params["r"]), int(params["p"]))
+        elif algorithm == "pbkdf2_sha256":
+            digest = _pbkdf2(password, salt, int(params["i"]))
+        else:
+            return False
+    except (ValueError, KeyError):
+        return False
+    return hmac.compare_digest(digest, _b64decode(expected))
+
+
+def needs_rehash(hashed_password: str, config: PasswordHashing) -> bool:
+    return not hashed_password.startswith(f"{config.algorithm}${_parameters(config)}$")
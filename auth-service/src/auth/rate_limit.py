@@ -0,0 +1,122 @@
+import ipaddress
+import math
+import time
+import typing
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from fastapi import HTTPException, Request, status
+
+import metrics
+from config import LoginRateLimit, settings
+
+RATE_LIMITED = metrics.Counter("auth_rate_limited_total", "Requests rejected by the login rate limiter", ["key"])
+
+
+class RateLimitStore(ABC):
+    """Token buckets by key.
+
+    The in-memory store limits one process; a shared implementation (Redis,
+    Postgres) can replace it to limit across instances.
+    """
+
+    @abstractmethod
+    async def hit(self, key: str, capacity: int, refill_per_second: float) -> float:
+        """Takes a token from ``key``'s bucket: 0 if there was one, else the seconds until there is."""
+        raise NotImplementedError
+
+
+class InMemoryRateLimitStore(RateLimitStore):
+    """Token buckets in an LRU dict of at most ``max_keys`` entries.
+
+    A bucket that has refilled completely is the same as no bucket, so idle
+    keys are dropped from the cold end as they are found; only when more than
+    ``max_keys`` keys are active at once does eviction forget a partly used
+    bucket.
+    """
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        # key -> (tokens left, updated at, full again at)
+        self._buckets: OrderedDict[str, tuple[float, float, float]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    async def hit(self, key: str, capacity: int, refill_per_second: float) -> float:
+        now = time.monotonic()
+        entry = self._buckets.pop(key, None)
+        if entry is None:
+            tokens = capacity
+        else:
+            tokens = min(capacity, entry[0] + (now - entry[1]) * refill_per_second)
+
+        if tokens >= 1:
+            tokens -= 1
+            wait = 0.0
+        else:
+            wait = (1 - tokens) / refill_per_second
+        self._buckets[key] = (tokens, now, now + (capacity - tokens) / refill_per_second)
+
+        self._evict(now)
+        return wait
+
+    def _evict(self, now: float) -> None:
+        # a couple of idle keys per hit keeps the dict small without a sweeper task
+        for _ in range(2):
+            oldest = next(iter(self._buckets.values()))
+            if oldest[2] > now:
+                break
+            self._buckets.popitem(last=False)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+
+
+class LoginRateLimiter:
+    """Token buckets per login, and per client IP when it is known, in front of the password check."""
+
+    def __init__(self, store: RateLimitStore, config: LoginRateLimit):
+        self.store = store
+        self.config = config
+        self.trusted_proxies = config.trusted_proxies if config.trust_forwarded_for else []
+
+    def _is_trusted_proxy(self, address: str) -> bool:
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        return any(ip in network for network in self.trusted_proxies)
+
+    def client_ip(self, request: Request) -> typing.Optional[str]:
+        """The client's address, None when it cannot be told apart from a proxy's."""
+        if not self.trusted_proxies or request.client is None:
+            return None
+        address = request.client.host
+        hops = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+        # each trusted proxy appended the address it saw, anything left of them is client-supplied
+        while self._is_trusted_proxy(address):
+            if not hops:
+                return None
+            address = hops.pop()
+        return address
+
+    async def check(self, request: Request, login: str) -> None:
+        if not self.config.enabled:
+            return
+        buckets = [("login", login[:256], self.config.per_login_burst, self.config.per_login_per_minute)]
+        ip = self.client_ip(request)
+        if ip is not None:
+            buckets.insert(0, ("ip", ip, self.config.per_ip_burst, self.config.per_ip_per_minute))
+        for name, key, capacity, per_minute in buckets:
+            wait = await self.store.hit(f"{name}:{key}", capacity, per_minute / 60)
+            if wait > 0:
+                RATE_LIMITED.inc(name)
+                raise HTTPException(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    detail="Too many login attempts, try again later",
+                    headers={"Retry-After": str(math.ceil(wait))},
+                )
+
+
+login_rate_limiter = LoginRateLimiter(InMemoryRateLimitStore(settings.login_rate_limit.max_keys),
+                                      settings.login_rate_limit)
@@ -0,0 +1,152 @@
+import array
+import asyncio
+import bisect
+import heapq
+import logging
+import time
+import typing
+import uuid
+from datetime import datetime, timedelta
+
+import metrics
+from config import settings
+from repositories.postgres_repository import Session, UnitOfWork
+
+logger = logging.getLogger(__name__)
+
+BUCKET_SECONDS = 3600
+# rows committed slightly out of revoked_at order are still picked up by the next sync
+SYNC_OVERLAP = timedelta(seconds=30)
+COMPACT_MIN = 256
+
+
+def _key(jti: str) -> int:
+    # the first 64 of the 122 random bits of a uuid4; two tokens sharing them is as good as impossible
+    return uuid.UUID(jti).int >> 64
+
+
+class _Bucket:
+    """Unique keys in a sorted array, plus a set of the ones added since it was last rebuilt."""
+
+    __slots__ = ("sorted", "recent")
+
+    def __init__(self, keys: typing.Iterable[int] = ()):
+        self.sorted = array.array("Q", sorted(keys))
+        self.recent: set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self.sorted) + len(self.recent)
+
+    def __contains__(self, key: int) -> bool:
+        if key in self.recent:
+            return True
+        index = bisect.bisect_left(self.sorted, key)
+        return index < len(self.sorted) and self.sorted[index] == key
+
+    def add(self, key: int) -> None:
+        if key in self:
+            return
+        self.recent.add(key)
+        # rebuilding once the set has grown by a quarter of the array keeps adds amortized O(1)
+        if len(self.recent) >= max(COMPACT_MIN, len(self.sorted) // 4):
+            self.sorted = array.array("Q", heapq.merge(self.sorted, sorted(self.recent)))
+            self.recent = set()
+
+
+class RevocationStore:
+    """In-memory copy of the unexpired rows of ``revoked_tokens``, about 8 bytes a token.
+
+    Token ids are bucketed by the hour the token expires, so a lookup is one
+    set probe and one binary search in the bucket the token's own ``exp``
+    names, and expired entries are dropped a whole bucket at a time. Beyond
+    ``max_tokens`` the buckets expiring soonest are dropped. The store is
+    loaded in the background after startup and then follows the table by
+    polling rows revoked since the last sync, so revocations made by other
+    workers show up within one sync interval. It is a fast path only:
+    rotation itself is decided by the ``revoked_tokens`` primary key, which
+    also covers tokens the store has not loaded or has dropped.
+    """
+
+    def __init__(self, max_tokens: int):
+        self.max_tokens = max_tokens
+        self._buckets: dict[int, _Bucket] = {}
+        self._synced_at: typing.Optional[datetime] = None
+        self.loaded = False
+
+    def __len__(self) -> int:
+        return sum(len(bucket) for bucket in self._buckets.values())
+
+    def add(self, jti: str, expires_at: float) -> None:
+        if expires_at > time.time():
+            hour = int(expires_at // BUCKET_SECONDS)
+            bucket = self._buckets.get(hour)
+            if bucket is None:
+                bucket = self._buckets[hour] = _Bucket()
+            bucket.add(_key(jti))
+
+    def is_revoked(self, jti: str, expires_at: float) -> bool:
+        bucket = self._buckets.get(int(expires_at // BUCKET_SECONDS))
+        return bucket is not None and _key(jti) in bucket
+
+    def prune(self) -> None:
+        current = int(time.time() // BUCKET_SECONDS)
+        for expired in [hour for hour in self._buckets if hour < current]:
+            del self._buckets[expired]
+        size = len(self)
+        for hour in sorted(self._buckets):
+            if size <= self.max_tokens:
+                break
+            size -= len(self._buckets.pop(hour))
+            logger.warning("More than %d revoked refresh tokens, dropped those expiring at %s",
+                           self.max_tokens, datetime.fromtimestamp(hour * BUCKET_SECONDS))
+
+    async def load(self) -> None:
+        keys: dict[int, array.array] = {}
+        synced_at = None
+        async with Session() as session:
+            async for jti, expires_at, revoked_at in UnitOfWork(session).revoked_tokens.stream_unexpired():
+                hour = int(expires_at.timestamp() // BUCKET_SECONDS)
+                bucket = keys.get(hour)
+                if bucket is None:
+                    bucket = keys[hour] = array.array("Q")
+                bucket.append(_key(jti))
+                if synced_at is None or revoked_at > synced_at:
+                    synced_at = revoked_at
+        # tokens revoked by this worker while loading are in the table too, the next sync brings them back
+        self._buckets = {hour: _Bucket(bucket) for hour, bucket in keys.items()}
+        self._synced_at = synced_at
+        self.loaded = True
+        self.prune()
+        logger.info("Loaded %d revoked refresh tokens", len(self))
+
+    async def sync(self, prune_table: bool = False) -> None:
+        since = self._synced_at - SYNC_OVERLAP if self._synced_at is not None else None
+        async with Session() as session:
+            uow = UnitOfWork(session)
+            async for jti, expires_at, revoked_at in uow.revoked_tokens.stream_unexpired(since):
+                self.add(jti, expires_at.timestamp())
+                if self._synced_at is None or revoked_at > self._synced_at:
+                    self._synced_at = revoked_at
+            if prune_table:
+                await uow.revoked_tokens.delete_expired()
+                await uow.commit()
+        self.prune()
+
+    async def run_periodic_sync(self, interval: float, prune_every: int = 360) -> None:
+        syncs = 0
+        while True:
+            try:
+                if not self.loaded:
+                    await self.load()
+                else:
+                    await self.sync(prune_table=syncs % prune_every == 0)
+            except Exception:
+                logger.exception("Revoked tokens sync failed, keeping the current set")
+            await asyncio.sleep(interval)
+            syncs += 1
+
+
+revocation_store = RevocationStore(settings.auth_jwt.revocation_max_tokens)
+
+metrics.CallbackMetric("auth_revoked_tokens_in_memory", "Revoked refresh tokens held by the revocation store",
+                       lambda: len(revocation_store))
@@ -1,75 +1,109 @@
 from datetime import timedelta
 
 import uuid
-from fastapi import Depends, HTTPException, status, APIRouter, Cookie, Response, Body
+from fastapi import (Depends, HTTPException, status, APIRouter, Cookie, Response, Body, BackgroundTasks, Header, Query,
+                     Form, UploadFile, Request)
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from sqlalchemy.exc import IntegrityError
 
+import metrics
+from auth import bulk
 from auth import schemas as auth_models
 from auth import utils
-from auth.dependencies import authentication_with_token, add_secret_depends
-from auth.utils import get_access_and_refresh_tokens
+from auth.keys import key_manager
+from auth.rate_limit import login_rate_limiter
+from auth.dependencies import (authentication_with_token, authentication_with_form_token,
+                               authentication_with_refresh_token, add_secret_depends)
+from auth.utils import TokenClaims, get_access_and_refresh_tokens
 from config import settings
 from repositories import models as repo_models
-from repositories.postgres_repository import UserRepository, SecretRepository
+from repositories.postgres_repository import (UserRepository, SecretRepository, UnitOfWork, secrets_query,
+                                              stream_secrets)
 
 DOMAIN = settings.domain
 
-auth_router = APIRouter(prefix="/personal")
+auth_router = APIRouter(prefix="/personal", default_response_class=ORJSONResponse)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="personal/token")
 
+LOGINS = metrics.Counter("auth_logins_total", "Login attempts on /personal/token by result", ["result"])
 
-@auth_router.post("/registration")
+
+def _invalid_secret() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid secret",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+
+def _user_exists() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail="User already exists",
+    )
+
+
+@auth_router.post("/registration", description="Register with an invite secret. Attempts are rate limited "
+                  "like /personal/token, over the limit the answer is 429 with Retry-After")
 async def registration(
     registration_request: auth_models.RegistrationRequest,
-    user_repository: UserRepository = Depends(UserRepository),
-    secret_repository: SecretRepository = Depends(SecretRepository),
+    request: Request,
+    uow: UnitOfWork = Depends(UnitOfWork),
 ):
-    user = await user_repository.get_user_by_login(registration_request.login)
-    if user:
-        raise HTTPException(
-            status_code=status.HTTP_409_CONFLICT,
-            detail="User already exists",
-        )
-    else:
-        secret_entity = await utils.check_secret(
-            registration_request.secret, secret_repository
-        )
-
-        secret_entity.used_by = user_id = uuid.uuid4()  # creating user_id
-        secret_entity.is_used = True
-        await secret_repository.add(secret_entity)
-
-        registration_request.password = utils.hash_password(
-            registration_request.password
-        )
-        await user_repository.add(
-            repo_models.User(
-                **registration_request.model_dump(exclude={"secret"}),
-                user_id=user_id,
-                used_secret=secret_entity.secret
-            )
-        )
+    await login_rate_limiter.check(request, registration_request.login)
+    # cheap checks first, so only a caller holding an unused secret gets to spend a hash; the insert
+    # below still decides races between registrations that pass them together
+    secret = await uow.secrets.get(registration_request.secret)
+    if secret is None or secret.is_used:
+        raise _invalid_secret()
+    if await uow.users.get_user_by_login(registration_request.login) is not None:
+        raise _user_exists()
+    await uow.commit()  # hand the connection back to the pool before hashing
+
+    registration_request.password = await utils.hash_password(
+        registration_request.password
+    )
+    user = repo_models.User(
+        **registration_request.model_dump(exclude={"secret"}),
+        user_id=str(uuid.uuid4()),
+    )
+    try:
+        registered = await uow.users.add_with_secret(user, registration_request.secret)
+    except IntegrityError:
+        raise _user_exists()
+    if not registered:
+        raise _invalid_secret()
+    await uow.commit()
 
 
 @auth_router.post(
     "/token",
-    description="Get access-token while user logs in",
+    description="Get access-token while user logs in. Attempts are rate limited per login, and per "
+    "client address when trusted proxies are configured; over the limit the answer is 429 with Retry-After",
     response_model=auth_models.Tokens,
     status_code=status.HTTP_200_OK,
 )
 async def login_for_access_token(
     login_credentials: auth_models.LoginCredentials,
-    user_repository: UserRepository = Depends(UserRepository),
+    request: Request,
+    background_tasks: BackgroundTasks,
+    uow: UnitOfWork = Depends(UnitOfWork),
 ):
+    await login_rate_limiter.check(request, login_credentials.login)
     user = await utils.authenticate_user(
-        login_credentials.login, login_credentials.password, user_repository
+        login_credentials.login, login_credentials.password, uow
     )
     if not user:
+        LOGINS.inc("failure")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    LOGINS.inc("success")
+    if utils.password_needs_rehash(user):
+        background_tasks.add_task(utils.rehash_password, user, login_credentials.password)
 
     return await get_access_and_refresh_tokens(user)
 
@@ -79,56 +113,136 @@ async def login_for_access_token(
     response_model=auth_models.Tokens,
     status_code=status.HTTP_200_OK,
     description="Refresh access-token and refresh-token key pair. Use when a user "
-    "authentication error occurs to get a new key pair",
+    "authentication error occurs to get a new key pair. Every refresh-token works once: "
+    "presenting a used one again revokes all refresh-tokens of the user",
 )
-async def refresh_token_regenerate(refresh_token: str = Body(..., embed=True),
-                                    user_repository: UserRepository = Depends(UserRepository)):
-    decoded_token = await utils.decode_token(refresh_token)
-    user_id = decoded_token.user_id
-    user = await user_repository.get(user_id)
+async def refresh_token_regenerate(claims: TokenClaims = Depends(authentication_with_refresh_token),
+                                    uow: UnitOfWork = Depends(UnitOfWork)):
+    return await utils.rotate_refresh_token(claims, uow)
 
-    return await get_access_and_refresh_tokens(user)
+
+@auth_router.post(
+    "/introspect",
+    response_model=list[auth_models.TokenIntrospection],
+    description="Validate a batch of access-tokens, results are returned in request order",
+)
+async def introspect(request: auth_models.IntrospectionRequest):
+    return await utils.introspect_tokens(request.tokens)
 
 
-@auth_router.post("/user", description="Get user by access-token (used for debugging)")
+@auth_router.get(
+    "/.well-known/jwks.json",
+    description="Public keys for verifying tokens locally, as a JSON Web Key Set",
+)
+async def jwks(if_none_match: str | None = Header(None)):
+    body, etag = key_manager.jwks()
+    headers = {
+        "Cache-Control": f"public, max-age={settings.auth_jwt.jwks_max_age_seconds}",
+        "ETag": etag,
+    }
+    if if_none_match == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@auth_router.post("/user", description="Get user by access-token (used for debugging)",
+                  response_model=auth_models.UserRead)
 async def get_user(
-    user_id: str = Depends(authentication_with_token),
+    claims: TokenClaims = Depends(authentication_with_token),
     user_repository: UserRepository = Depends(UserRepository),
 ):
-    user = await user_repository.get(user_id)
-    return user.__dict__
+    user = await user_repository.get(claims.user_id)
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found",
+        )
+    return user
 
 
 @auth_router.get("/user/{uuid}/token", description="Get access-token by user UUID",
                  response_model=auth_models.Tokens)
 async def get_token_by_uuid(uuid: uuid.UUID, user_repository: UserRepository = Depends(UserRepository)):
-    user = await user_repository.get(uuid)
-    return await get_access_and_refresh_tokens(user)
+    return await utils.get_tokens_for_user(str(uuid), user_repository)
 
 
 @auth_router.post("/user/update", description="Update User")
 async def update_user(
     user_id: uuid.UUID = Body(..., embed=True),
     has_face_id: bool = Body(..., embed=True),
-    user_repository: UserRepository = Depends(UserRepository),
+    uow: UnitOfWork = Depends(UnitOfWork),
 ):
-    user = await user_repository.get(user_id)
-    user.is_active = has_face_id
-    await user_repository.merge(user)
+    await uow.users.update(user_id, is_active=has_face_id)
+    await uow.commit()
+    utils.forget_issued_tokens(str(user_id))
 
 
-@auth_router.post("/secrets", description="Get all secrets")
+@auth_router.post(
+    "/secrets",
+    response_model=auth_models.SecretsPage,
+    description="List secrets page by page, oldest first. With `stream=true` all matching secrets "
+    "are returned as NDJSON (one secret per line) and `limit` is ignored",
+)
 async def get_secrets(
-    user_id: str = Depends(authentication_with_token),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: str | None = None,
+    is_used: bool | None = None,
+    created_by: str | None = None,
+    stream: bool = False,
+    claims: TokenClaims = Depends(authentication_with_token),
     secret_repository: SecretRepository = Depends(SecretRepository),
 ):
-    secrets = await secret_repository.get_secrets()
-    return secrets
+    after = utils.decode_secrets_cursor(cursor) if cursor else None
+    if stream:
+        rows = stream_secrets(secrets_query(after, is_used, created_by))
+        return StreamingResponse(
+            (auth_models.SecretRead.model_validate(secret).model_dump_json() + "\n" async for secret in rows),
+            media_type="application/x-ndjson",
+        )
+
+    secrets = await secret_repository.get_secrets(limit, after, is_used, created_by)
+    next_cursor = utils.encode_secrets_cursor(secrets[-1]) if len(secrets) == limit else None
+    return auth_models.SecretsPage(items=secrets, next_cursor=next_cursor)
 
 
 @auth_router.post("/add_secret", description="Add new secret")
 async def add_secret(
     secret: auth_models.Secret = Depends(add_secret_depends),
-    secret_repository: SecretRepository = Depends(SecretRepository),
+    uow: UnitOfWork = Depends(UnitOfWork),
 ):
-    await secret_repository.add(repo_models.Secret(**secret.model_dump()))
\ No newline at end of file
+    await uow.secrets.add(repo_models.Secret(**secret.model_dump()))
+    await uow.commit()
+
+
+@auth_router.post("/secrets/generate", response_model=auth_models.BulkSecretsResult,
+                  description="Generate and store `count` new secrets")
+async def generate_secrets(
+    count: int = Form(..., ge=1, le=settings.bulk_secrets_max),
+    created_by: str = Form(..., description='vasya'),
+    claims: TokenClaims = Depends(authentication_with_form_token),
+    uow: UnitOfWork = Depends(UnitOfWork),
+):
+    secrets = bulk.generate_secrets(count)
+    stats = await bulk.import_secrets(uow, ((secret, created_by) for secret in secrets))
+    return auth_models.BulkSecretsResult(received=stats.received, inserted=stats.inserted, skipped=stats.skipped,
+                                         rows_per_second=stats.rows_per_second, secrets=secrets)
+
+
+@auth_router.post("/secrets/import", response_model=auth_models.BulkSecretsResult,
+                  description="Import secrets from a `secret[,created_by]` CSV file. Secrets that already "
+                  "exist are skipped, so a file can be imported again safely")
+async def import_secrets(
+    file: UploadFile,
+    created_by: str = Form(..., description='used for rows without created_by'),
+    claims: TokenClaims = Depends(authentication_with_form_token),
+    uow: UnitOfWork = Depends(UnitOfWork),
+):
+    try:
+        stats = await bulk.import_secrets(uow, bulk.read_secrets_upload(file, created_by))
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=str(e),
+        )
+    return auth_models.BulkSecretsResult(received=stats.received, inserted=stats.inserted, skipped=stats.skipped,
+                                         rows_per_second=stats.rows_per_second)
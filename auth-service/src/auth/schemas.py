@@ -1,6 +1,10 @@
+import typing
 import uuid
+from datetime import datetime
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
+
+from config import settings
 
 
 class RegistrationRequest(BaseModel):
@@ -16,6 +20,47 @@ class Secret(BaseModel):
     created_by: str
 
 
+# response-only: the database hands out UUIDs as strings, parsing them into uuid.UUID
+# just to print them again doubles the cost of serializing large listings
+UUIDString = typing.Annotated[str, Field(json_schema_extra={"format": "uuid"})]
+
+
+class UserRead(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    user_id: UUIDString
+    login: str
+    name: str
+    surname: str
+    has_face_id: typing.Optional[bool] = None
+    is_active: typing.Optional[bool] = None
+    used_secret: typing.Optional[UUIDString] = None
+    created_at: typing.Optional[datetime] = None
+
+
+class SecretRead(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    secret: UUIDString
+    created_by: str
+    used_by: typing.Optional[UUIDString] = None
+    is_used: typing.Optional[bool] = None
+    created_at: typing.Optional[datetime] = None
+
+
+class SecretsPage(BaseModel):
+    items: list[SecretRead]
+    next_cursor: typing.Optional[str] = Field(None, description="Pass as `cursor` to get the next page")
+
+
+class BulkSecretsResult(BaseModel):
+    received: int
+    inserted: int
+    skipped: int = Field(..., description="Secrets that already existed")
+    rows_per_second: float
+    secrets: typing.Optional[list[UUIDString]] = None
+
+
 class Tokens(BaseModel):
     access_token: str
     refresh_token: str
@@ -24,3 +69,16 @@ class Tokens(BaseModel):
 class LoginCredentials(BaseModel):
     login: str
     password: str
+
+
+class IntrospectionRequest(BaseModel):
+    tokens: list[str] = Field(..., min_length=1, max_length=settings.introspection_max_tokens)
+
+
+class TokenIntrospection(BaseModel):
+    active: bool
+    user_id: typing.Optional[str] = None
+    login: typing.Optional[str] = None
+    has_face_id: typing.Optional[bool] = None
+    exp: typing.Optional[int] = None
+    error: typing.Optional[str] = None
@@ -1,81 +1,360 @@
+import asyncio
+import base64
+import enum
 import hashlib
+import secrets
+import time
 import typing
-from datetime import datetime, timedelta
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
 
 import jwt
 import uuid
 from fastapi import HTTPException, status
 
-from auth.schemas import Tokens
+from auth import passwords
+from auth.activity import activity_recorder
+from auth.executor import hashing_executor, signing_executor
+from auth.keys import key_manager
+from auth.revocation import revocation_store
+from auth.schemas import TokenIntrospection, Tokens
+import metrics
+from cache import TTLCache
 from config import settings
 from repositories import models
-from repositories.postgres_repository import UserRepository, SecretRepository
+from repositories.postgres_repository import Session, UnitOfWork, UserRepository
+from singleflight import SingleFlight
 from pydantic import UUID4
 
 ACCESS_TOKEN_EXPIRE_MINUTES = settings.auth_jwt.access_token_expire_minutes
 REFRESH_TOKEN_EXPIRE_HOURS = settings.auth_jwt.refresh_token_expire_hours
 
-DecodedToken = typing.NamedTuple("decoded_token", [("user_id", str), ("login", str)])
+# verified access-token claims keyed by a digest of the token, each entry lives until the token's exp
+token_cache = TTLCache(settings.token_cache.max_size, ttl=0) if settings.token_cache.enabled else None
+
+# (access token, has_face_id, token_version) by user id for get_tokens_for_user, reused while the
+# access token has enough of its lifetime left
+ISSUANCE_TTL_SECONDS = ACCESS_TOKEN_EXPIRE_MINUTES * 60 * (1 - settings.issuance_cache.min_remaining_fraction)
+issued_tokens = TTLCache(settings.issuance_cache.max_size, ISSUANCE_TTL_SECONDS) \
+    if settings.issuance_cache.enabled else None
+_issuance_epoch = 0  # bumped by every invalidation, so a mint that raced one is not cached
+
+_DUMMY_HASH: typing.Optional[str] = None  # made with the current parameters on first use, see authenticate_user
+
+access_token_mints = SingleFlight()
+
+CRYPTO_SECONDS = metrics.Histogram(
+    "auth_crypto_seconds",
+    "JWT signing and verification and password hashing; executor jobs include the wait for a worker",
+    ["operation"],
+)
+
+
+class TokenType(str, enum.Enum):
+    ACCESS = "access"
+    REFRESH = "refresh"
+
+
+@dataclass(frozen=True, slots=True)
+class TokenClaims:
+    user_id: str
+    login: typing.Optional[str]
+    has_face_id: bool
+    exp: int
+    type: TokenType
+    # refresh tokens only
+    jti: typing.Optional[str] = None
+    token_version: int = 0
 
 
 async def authenticate_user(login: str, password: str,
-                            user_repository: UserRepository) -> typing.Union[models.User, bool]:
-    user = await user_repository.get_user_by_login(login)
-    if not hashlib.sha256(password.encode()).hexdigest() == user.password:
+                            uow: UnitOfWork) -> typing.Union[models.User, bool]:
+    user = await uow.users.get_user_by_login(login)
+    await uow.commit()  # hand the connection back to the pool before hashing
+    if not user:
+        # as slow as a wrong password, so response times do not tell which logins exist
+        await hashing_executor.run(passwords.verify_password, password, await _dummy_hash())
+        return False
+    with CRYPTO_SECONDS.timer("password_verify"):
+        verified = await hashing_executor.run(passwords.verify_password, password, user.password)
+    if not verified:
+        activity_recorder.login_failed(user.user_id)
         return False
+    activity_recorder.login_succeeded(user.user_id)
     return user
 
 
+async def _dummy_hash() -> str:
+    global _DUMMY_HASH
+    if _DUMMY_HASH is None:
+        _DUMMY_HASH = await hash_password(secrets.token_urlsafe())
+    return _DUMMY_HASH
+
+
+def password_needs_rehash(user: models.User) -> bool:
+    return passwords.needs_rehash(user.password, settings.password_hashing)
+
+
+async def rehash_password(user: models.User, password: str) -> None:
+    # runs as a background task after the request session is closed, so it opens its own
+    new_hash = await hash_password(password)
+    async with Session() as session:
+        uow = UnitOfWork(session)
+        await uow.users.update_password(user.user_id, user.password, new_hash)
+        await uow.commit()
+
+
+def _encode(data: dict) -> str:
+    key = key_manager.signing_key
+    return jwt.encode(data, key.private_key, algorithm=key.algorithm, headers={"kid": key.kid})
+
+
+@metrics.timed(CRYPTO_SECONDS, "jwt_sign")
 async def create_token(data: dict, expires_delta: timedelta = None):
     if expires_delta:
         data.update({"exp": datetime.utcnow() + expires_delta})
-    encoded_jwt = jwt.encode(data, settings.auth_jwt.private_key_path.read_text(),
-                             algorithm=settings.auth_jwt.algorithm)
+    encoded_jwt = await signing_executor.run(_encode, data)
     return encoded_jwt
 
 
-async def get_access_and_refresh_tokens(user: models.User) -> Tokens:
-    access_token = await create_token(
-        data={"user_id": user.user_id, "login": user.login, "has_face_id": user.has_face_id},
+def _access_token(user: models.User) -> typing.Awaitable[str]:
+    return create_token(
+        data={"user_id": user.user_id, "login": user.login, "has_face_id": user.has_face_id,
+              "type": TokenType.ACCESS.value},
         expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES),
     )
-    refresh_token = await create_token(
-        data={"user_id": user.user_id, "has_face_id": user.has_face_id},
+
+
+def _refresh_token(user_id: str, has_face_id: bool, token_version: int) -> typing.Awaitable[str]:
+    return create_token(
+        data={"user_id": user_id, "has_face_id": has_face_id, "type": TokenType.REFRESH.value,
+              "jti": str(uuid.uuid4()), "ver": token_version},
         expires_delta=timedelta(hours=REFRESH_TOKEN_EXPIRE_HOURS),
     )
 
+
+async def get_access_and_refresh_tokens(user: models.User) -> Tokens:
+    # concurrent mints for the same user share one access token; refresh tokens are
+    # never shared, each one starts its own rotation chain
+    (access_token, _), refresh_token = await asyncio.gather(
+        access_token_mints.do((user.user_id, user.login, user.has_face_id), lambda: _access_token(user)),
+        _refresh_token(user.user_id, user.has_face_id, user.token_version or 0),
+    )
+
     return Tokens(access_token=access_token, refresh_token=refresh_token)
 
 
-async def decode_token(token: str) -> DecodedToken:
-    user_id = (
-        jwt.decode(token, settings.auth_jwt.public_key_path.read_text(), algorithms=settings.auth_jwt.algorithm)).get(
-        "user_id")
-    login = (
-        jwt.decode(token, settings.auth_jwt.public_key_path.read_text(), algorithms=settings.auth_jwt.algorithm)).get(
-        "login"
+async def get_tokens_for_user(user_id: str, users: UserRepository) -> Tokens:
+    """Issues a pair for a user by id, for other services.
+
+    With ``issuance_cache`` the access token minted last is handed out again;
+    the refresh token is always a new one.
+    """
+    if issued_tokens is not None:
+        cached = issued_tokens.get(user_id)
+        if cached is not None:
+            access_token, has_face_id, token_version = cached
+            return Tokens(access_token=access_token,
+                          refresh_token=await _refresh_token(user_id, has_face_id, token_version))
+
+    started, epoch = time.monotonic(), _issuance_epoch
+    user = await users.get(user_id)
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found",
+        )
+    tokens = await get_access_and_refresh_tokens(user)
+    if issued_tokens is not None and epoch == _issuance_epoch:
+        issued_tokens.set(user_id, (tokens.access_token, user.has_face_id, user.token_version or 0),
+                          ttl=ISSUANCE_TTL_SECONDS - (time.monotonic() - started))
+    return tokens
+
+
+def forget_issued_tokens(user_id: str) -> None:
+    global _issuance_epoch
+    if issued_tokens is not None:
+        _issuance_epoch += 1
+        issued_tokens.pop(user_id)
+
+
+def _verification_key(token: str):
+    header = jwt.get_unverified_header(token)
+    return key_manager.get_verification_key(header.get("kid"), header.get("alg"))
+
+
+def _decode(token: str) -> tuple[str, TokenClaims]:
+    key = _verification_key(token)
+    payload = jwt.decode(token, key.public_key, algorithms=[key.algorithm],
+                         options={"require": ["exp", "user_id"]})
+
+    # tokens issued before the "type" claim existed: only access tokens carried the login
+    token_type = payload.get("type") or (TokenType.ACCESS if "login" in payload else TokenType.REFRESH)
+    return key.kid, TokenClaims(
+        user_id=payload["user_id"],
+        login=payload.get("login"),
+        has_face_id=bool(payload.get("has_face_id")),
+        exp=payload["exp"],
+        type=TokenType(token_type),
+        jti=payload.get("jti"),
+        token_version=payload.get("ver", 0),
+    )
+
+
+def _token_digest(token: str) -> bytes:
+    return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+
+def _cached_claims(digest: bytes) -> typing.Optional[TokenClaims]:
+    cached = token_cache.get(digest)
+    if cached is not None and key_manager.has_key(cached[0]):
+        return cached[1]
+    return None
+
+
+def _remember_claims(digest: bytes, kid: str, claims: TokenClaims) -> None:
+    ttl = claims.exp - time.time()
+    if ttl > 0:
+        token_cache.set(digest, (kid, claims), ttl=ttl)
+
+
+async def decode_token(token: str, expected_type: TokenType = TokenType.ACCESS) -> TokenClaims:
+    # only access tokens are cached, refresh tokens are presented once per rotation
+    digest = None
+    if token_cache is not None and expected_type == TokenType.ACCESS:
+        digest = _token_digest(token)
+        claims = _cached_claims(digest)
+        if claims is not None:
+            return claims
+
+    with CRYPTO_SECONDS.timer("jwt_verify"):
+        kid, claims = _decode(token)
+    if claims.type != expected_type:
+        raise jwt.exceptions.InvalidTokenError(f"Expected {expected_type.value} token")
+
+    if digest is not None:
+        _remember_claims(digest, kid, claims)
+    return claims
+
+
+def _revoked() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Token has been revoked",
+        headers={"WWW-Authenticate": "Bearer"},
     )
-    return DecodedToken(user_id=user_id, login=login)
 
 
-async def decode_access_token(token: str):
-    uuid = (jwt.decode(token, settings.auth_jwt.public_key_path.read_text(),
-                       algorithms=settings.auth_jwt.algorithm))["user_id"]
-    return uuid
+async def _revoke_all(user_id: str, uow: UnitOfWork) -> None:
+    # a refresh token presented twice means it leaked: log out every session of the user
+    await uow.users.update(user_id, token_version=models.User.token_version + 1)
+    await uow.commit()
+    forget_issued_tokens(user_id)
+
 
+async def rotate_refresh_token(claims: TokenClaims, uow: UnitOfWork) -> Tokens:
+    """Exchanges a refresh token for a new pair, the presented token can never be used again.
 
-def hash_password(password: str):
-    hashed_password = hashlib.sha256(password.encode()).hexdigest()
-    return hashed_password
+    Presenting it again counts as reuse even while its first rotation is
+    still running: the second rotation waits for the user row lock, finds
+    the token revoked and revokes the whole family, so a stolen token raced
+    against its owner does not get a refresh chain of its own.
+    """
+    if claims.jti is None:
+        raise _revoked()  # issued before rotation, cannot be tracked
+    if revocation_store.is_revoked(claims.jti, claims.exp):
+        await _revoke_all(claims.user_id, uow)
+        raise _revoked()
 
+    # locked, so a concurrent _revoke_all either waits for this rotation or is seen by it
+    user = await uow.users.get(claims.user_id, for_update=True)
+    if user is None or (user.token_version or 0) != claims.token_version:
+        raise _revoked()
 
-async def check_secret(secret: uuid.UUID, secret_repository: SecretRepository):
-    secret_entity = await secret_repository.get(secret)
-    if not secret_entity:
+    revoked = models.RevokedToken(jti=claims.jti, user_id=claims.user_id,
+                                  expires_at=datetime.fromtimestamp(claims.exp, timezone.utc))
+    if not await uow.revoked_tokens.add(revoked):
+        # reused on another worker, or concurrently, before the in-memory store heard of it
+        await uow.rollback()
+        await _revoke_all(claims.user_id, uow)
+        raise _revoked()
+    # minted before the commit, still under the lock: if minting fails (503, cancellation) the
+    # revocation is rolled back with the session and the client can retry with the same token
+    tokens = await get_access_and_refresh_tokens(user)
+    await uow.commit()
+    revocation_store.add(claims.jti, claims.exp)
+    activity_recorder.refreshed(user.user_id)
+
+    return tokens
+
+
+def _decode_many(tokens: list[str]) -> list[typing.Union[tuple[str, TokenClaims], Exception]]:
+    results = []
+    for token in tokens:
+        try:
+            results.append(_decode(token))
+        except (jwt.exceptions.InvalidTokenError, ValueError) as e:
+            results.append(e)
+    return results
+
+
+def _introspection(claims: TokenClaims) -> TokenIntrospection:
+    if claims.type != TokenType.ACCESS:
+        return TokenIntrospection(active=False, error="Invalid token")
+    return TokenIntrospection(active=True, user_id=claims.user_id, login=claims.login,
+                              has_face_id=claims.has_face_id, exp=claims.exp)
+
+
+async def introspect_tokens(tokens: list[str]) -> list[TokenIntrospection]:
+    results: dict[str, TokenIntrospection] = {}
+    pending: dict[str, typing.Optional[bytes]] = {}
+    for token in tokens:
+        if token in results or token in pending:
+            continue
+        digest = _token_digest(token) if token_cache is not None else None
+        claims = _cached_claims(digest) if digest is not None else None
+        if claims is not None:
+            results[token] = _introspection(claims)
+        else:
+            pending[token] = digest
+
+    if pending:
+        # one job per worker rather than per token, so a full batch fits within the executor's queue limit
+        to_verify = list(pending)
+        chunk_size = -(-len(to_verify) // signing_executor.max_workers)
+        chunks = [to_verify[i:i + chunk_size] for i in range(0, len(to_verify), chunk_size)]
+        with CRYPTO_SECONDS.timer("jwt_verify_batch"):
+            verified = await asyncio.gather(*(signing_executor.run(_decode_many, chunk) for chunk in chunks))
+
+        for token, result in zip(to_verify, (result for chunk in verified for result in chunk)):
+            if isinstance(result, jwt.exceptions.ExpiredSignatureError):
+                results[token] = TokenIntrospection(active=False, error="Token has expired")
+            elif isinstance(result, Exception):
+                results[token] = TokenIntrospection(active=False, error="Invalid token")
+            else:
+                kid, claims = result
+                if pending[token] is not None and claims.type == TokenType.ACCESS:
+                    _remember_claims(pending[token], kid, claims)
+                results[token] = _introspection(claims)
+
+    return [results[token] for token in tokens]
+
+
+def encode_secrets_cursor(secret: models.Secret) -> str:
+    return base64.urlsafe_b64encode(f"{secret.created_at.isoformat()}|{secret.secret}".encode()).decode()
+
+
+def decode_secrets_cursor(cursor: str) -> tuple[datetime, str]:
+    try:
+        created_at, secret = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), str(uuid.UUID(secret))
+    except ValueError:
         raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid secret",
-            headers={"WWW-Authenticate": "Bearer"},
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor",
         )
-    else:
-        return secret_entity
+
+
+@metrics.timed(CRYPTO_SECONDS, "password_hash")
+async def hash_password(password: str) -> str:
+    return await hashing_executor.run(passwords.hash_password, password, settings.password_hashing)
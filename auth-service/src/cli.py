@@ -0,0 +1,114 @@
+"""Admin commands, run next to main.py: ``python cli.py --help``."""
+import asyncio
+import dataclasses
+import json
+import os
+import typing
+
+import click
+
+from auth import bulk
+from repositories.postgres_repository import Session, UnitOfWork, engine
+
+
+async def _import_secrets(rows: typing.Iterable[tuple[str, str]]) -> bulk.ImportStats:
+    try:
+        async with Session() as session:
+            return await bulk.import_secrets(UnitOfWork(session), rows)
+    finally:
+        await engine.dispose()
+
+
+def _report(stats: bulk.ImportStats) -> None:
+    click.echo(f"{stats.received} rows, {stats.inserted} inserted, {stats.skipped} already existed "
+               f"in {stats.seconds:.2f}s ({stats.rows_per_second:,.0f} rows/s)", err=True)
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.group()
+def secrets():
+    """Invite secrets."""
+
+
+@secrets.command()
+@click.argument("count", type=click.IntRange(min=1))
+@click.option("--created-by", required=True)
+@click.option("--output", type=click.File("w"), default="-", help="Where to write the new secrets, stdout by default")
+def generate(count: int, created_by: str, output: typing.TextIO):
+    """Generate COUNT secrets and store them."""
+    new_secrets = bulk.generate_secrets(count)
+    stats = asyncio.run(_import_secrets((secret, created_by) for secret in new_secrets))
+    output.writelines(secret + "\n" for secret in new_secrets)
+    _report(stats)
+
+
+@secrets.command("import")
+@click.argument("file", type=click.File("r", encoding="utf-8-sig"))
+@click.option("--created-by", required=True, help="For rows without a created_by column")
+def import_secrets(file: typing.TextIO, created_by: str):
+    """Import secrets from a secret[,created_by] CSV FILE; existing secrets are skipped."""
+    try:
+        stats = asyncio.run(_import_secrets(bulk.read_secrets_csv(file, created_by)))
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    _report(stats)
+
+
+async def _import_users(rows: typing.Iterable, created_by: str, workers: int, batch_size: int, offset: int,
+                        errors: typing.TextIO) -> bulk.UserImportStats:
+    stats = bulk.UserImportStats(last_row=offset)
+    try:
+        async for stats, failed in bulk.import_users(rows, created_by, workers, batch_size):
+            errors.writelines(json.dumps(dataclasses.asdict(error), ensure_ascii=False) + "\n" for error in failed)
+            errors.flush()
+            click.echo(f"row {stats.last_row:,}: {stats.inserted:,} inserted, {stats.failed:,} failed, "
+                       f"{stats.rows_per_second:,.0f} rows/s", err=True)
+    except BaseException:
+        click.echo(f"Interrupted, resume with --offset {stats.last_row}", err=True)
+        raise
+    finally:
+        await engine.dispose()
+    return stats
+
+
+@cli.group()
+def users():
+    """User accounts."""
+
+
+@users.command("import")
+@click.argument("file", type=click.File("r", encoding="utf-8-sig"))
+@click.option("--created-by", required=True, help="For the secrets created for users that come without one")
+@click.option("--format", "file_format", type=click.Choice(["csv", "ndjson"]),
+              help="By default ndjson for .ndjson and .jsonl files, csv otherwise")
+@click.option("--offset", type=click.IntRange(min=0), default=0, help="Rows to skip, to resume an interrupted import")
+@click.option("--errors", type=click.File("w"), default="-", help="Where to write failed rows as NDJSON, stdout by default")
+@click.option("--workers", type=click.IntRange(min=1), default=os.cpu_count() or 1, show_default=True,
+              help="Password hashing processes")
+@click.option("--batch-size", type=click.IntRange(min=1), default=bulk.USER_BATCH_SIZE, show_default=True)
+def import_users(file: typing.TextIO, created_by: str, file_format: str | None, offset: int, errors: typing.TextIO,
+                 workers: int, batch_size: int):
+    """Import users from a login,password,name,surname[,secret] CSV or NDJSON FILE.
+
+    Every user claims its secret, or a new one when the row has none or the
+    secret does not exist yet. Batches are committed one at a time. Rows whose
+    login exists already are reported as failed, so an interrupted import can
+    be resumed from the offset it printed, or simply run again.
+    """
+    if file_format is None:
+        file_format = "ndjson" if file.name.endswith((".ndjson", ".jsonl")) else "csv"
+    try:
+        stats = asyncio.run(_import_users(bulk.read_users(file, file_format, offset), created_by, workers,
+                                          batch_size, offset, errors))
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"{stats.received} rows, {stats.inserted} inserted, {stats.failed} failed in {stats.seconds:.2f}s "
+               f"({stats.rows_per_second:,.0f} rows/s, {stats.writing_seconds:.2f}s writing)", err=True)
+
+
+if __name__ == "__main__":
+    cli()
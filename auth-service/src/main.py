@@ -1,13 +1,98 @@
-from fastapi import FastAPI
+import asyncio
+import contextlib
+import signal
+
+from fastapi import FastAPI, Request, Response, status
 from sqladmin import Admin
 
+import metrics
+from auth import utils
+from auth.activity import activity_recorder
+from auth.executor import hashing_executor, signing_executor
+from auth.keys import key_manager
+from auth.revocation import revocation_store
 from auth.router import auth_router
+from config import settings
 from repositories.models import SecretsAdmin, UsersAdmin
-from repositories.postgres_repository import engine
+from repositories.postgres_repository import (engine, pool_checkouts, primary_is_up, user_cache, user_lookups,
+                                              warm_up_pool)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.ready = False
+    key_manager.load()
+    if settings.db_pool.warm_up:
+        await warm_up_pool(settings.db_pool.size)
+
+    loop = asyncio.get_running_loop()
+    with contextlib.suppress(AttributeError, NotImplementedError):  # no SIGHUP on Windows
+        loop.add_signal_handler(signal.SIGHUP, key_manager.reload)
+
+    # loads the revocation store in the background: until then rotation relies on the table alone
+    background_tasks = [asyncio.create_task(
+        revocation_store.run_periodic_sync(settings.auth_jwt.revocation_sync_interval_seconds)
+    )]
+    if settings.auth_jwt.key_reload_interval_seconds > 0:
+        background_tasks.append(asyncio.create_task(
+            key_manager.run_periodic_reload(settings.auth_jwt.key_reload_interval_seconds)
+        ))
+
+    activity_recorder.start()
+
+    app.state.ready = True
+    yield
+    app.state.ready = False
+
+    for task in background_tasks:
+        task.cancel()
+    try:
+        await activity_recorder.close()
+    finally:
+        signing_executor.shutdown()
+        hashing_executor.shutdown()
+        await engine.dispose()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(auth_router)
 
+if settings.debug_pool_checkouts:
+    @app.middleware("http")
+    async def count_pool_checkouts(request: Request, call_next):
+        counter = [0]
+        token = pool_checkouts.set(counter)
+        try:
+            response = await call_next(request)
+        finally:
+            pool_checkouts.reset(token)
+        response.headers["X-DB-Checkouts"] = str(counter[0])
+        return response
+
+if settings.metrics_enabled:
+    app.add_middleware(metrics.MetricsMiddleware)
+
+    caches = {name: cache for name, cache in (("token", utils.token_cache), ("user", user_cache),
+                                              ("issuance", utils.issued_tokens)) if cache is not None}
+    for stat, kind in (("hits", "counter"), ("misses", "counter"), ("evictions", "counter"), ("size", "gauge")):
+        metrics.CallbackMetric(
+            f"cache_{stat}" + ("_total" if kind == "counter" else ""), f"In-process cache {stat}",
+            lambda stat=stat: {(name,): cache.stats()[stat] for name, cache in caches.items()},
+            ["cache"], kind=kind,
+        )
+
+    flights = {"user_lookups": user_lookups, "access_token_mints": utils.access_token_mints}
+    metrics.CallbackMetric("singleflight_calls_total", "Calls that ran", lambda: {
+        (name,): flight.calls for name, flight in flights.items()
+    }, ["flight"], kind="counter")
+    metrics.CallbackMetric("singleflight_coalesced_total", "Calls that shared another call's result", lambda: {
+        (name,): flight.coalesced for name, flight in flights.items()
+    }, ["flight"], kind="counter")
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics_endpoint():
+        return Response(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
 admin = Admin(app, engine)
 admin.add_view(SecretsAdmin)
 admin.add_view(UsersAdmin)
@@ -18,3 +103,12 @@ async def root():
     return {"message": "Hello World"}
 
 
+@app.get("/ready", description="200 once signing keys are loaded and the connection pools are warm, while the "
+         "primary database answers through the pool; 503 otherwise")
+async def ready(response: Response):
+    is_ready = getattr(app.state, "ready", False) and await primary_is_up(settings.db_pool.ready_check_timeout_seconds)
+    if not is_ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return {"ready": is_ready}
+
+
@@ -0,0 +1,211 @@
+"""Prometheus metrics without a client library.
+
+Counters and histograms are plain dicts and lists, updated from the event
+loop thread only, so an observation costs a few hundred nanoseconds and needs
+no lock. Values owned by other objects (pool size, cache hits) are read by
+callbacks when ``/metrics`` is scraped.
+"""
+import bisect
+import contextlib
+import functools
+import inspect
+import time
+import typing
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list["_Metric"] = []
+
+    def register(self, metric: "_Metric") -> None:
+        if any(registered.name == metric.name for registered in self._metrics):
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: typing.Sequence[str] = (),
+                 registry: typing.Optional[Registry] = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        if registry is not None:
+            registry.register(self)
+
+    def samples(self) -> typing.Iterator[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self) -> typing.Iterator[str]:
+        for labels, value in self._values.items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class CallbackMetric(_Metric):
+    """A gauge (or counter) whose value is read from ``callback`` on every scrape.
+
+    The callback returns a number, or a dict of label-value tuples to numbers.
+    """
+
+    def __init__(self, name: str, documentation: str, callback: typing.Callable[[], typing.Any],
+                 labelnames: typing.Sequence[str] = (), kind: str = "gauge",
+                 registry: typing.Optional[Registry] = REGISTRY):
+        self.callback = callback
+        self.kind = kind
+        super().__init__(name, documentation, labelnames, registry)
+
+    def samples(self) -> typing.Iterator[str]:
+        values = self.callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labels, value in values.items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: typing.Sequence[str] = (),
+                 buckets: typing.Sequence[float] = DEFAULT_BUCKETS, registry: typing.Optional[Registry] = REGISTRY):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> per-bucket counts (not cumulative), the +Inf bucket, then the sum
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def count(self, *labels) -> int:
+        series = self._series.get(labels)
+        return sum(series[:-1]) if series is not None else 0
+
+    @contextlib.contextmanager
+    def timer(self, *labels) -> typing.Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def samples(self) -> typing.Iterator[str]:
+        bucket_labels = (*self.labelnames, "le")
+        for labels, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), series):
+                cumulative += count
+                yield f"{self.name}_bucket{_labels(bucket_labels, (*labels, _number(bound)))} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(series[-1])}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}"
+
+
+def timed(histogram: Histogram, *labels):
+    """Decorator observing the duration of every call of a coroutine function."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, *labels)
+        return wrapper
+    return decorator
+
+
+def time_methods(histogram: Histogram):
+    """Class decorator applying ``timed`` to every public coroutine method, labelled ``Class.method``."""
+    def decorator(cls):
+        for name, member in list(vars(cls).items()):
+            if not name.startswith("_") and inspect.iscoroutinefunction(member):
+                setattr(cls, name, timed(histogram, f"{cls.__name__}.{name}")(member))
+        return cls
+    return decorator
+
+
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "HTTP request latency by route template",
+                            ["method", "route"])
+REQUESTS = Counter("http_requests_total", "HTTP requests by route template and status", ["method", "route", "status"])
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording REQUEST_SECONDS and REQUESTS.
+
+    Routes are labelled with their path template (``/personal/user/{uuid}/token``),
+    never the raw path, so the number of series stays bounded. Requests that
+    match no FastAPI route, including everything under mounted apps, share the
+    ``<unmatched>`` label.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", "<unmatched>")
+            REQUEST_SECONDS.observe(time.perf_counter() - started, scope["method"], path)
+            REQUESTS.inc(scope["method"], path, status_code)
@@ -1,7 +1,8 @@
 import uuid
+from collections import namedtuple
 
 from sqladmin import ModelView
-from sqlalchemy import DateTime, String, func, Boolean, ForeignKey, Integer, UUID, text
+from sqlalchemy import DateTime, String, func, Boolean, ForeignKey, Index, Integer, UUID, text
 from sqlalchemy.orm import DeclarativeBase, mapped_column, relationship
 
 
@@ -33,16 +34,40 @@ class User(Base):
     name = mapped_column(String, nullable=False)
     surname = mapped_column(String, nullable=False)
 
-    used_secret = mapped_column(ForeignKey("secrets.secret"), nullable=True)
+    used_secret = mapped_column(ForeignKey("secrets.secret"), nullable=True, index=True)
 
     created_at = mapped_column(DateTime(timezone=True), server_default=func.now())
     is_active = mapped_column(Boolean, default=True)
+    # part of every refresh token, bumping it revokes all of the user's refresh tokens at once
+    token_version = mapped_column(Integer, nullable=False, server_default="0")
+
+    # written behind the requests by auth.activity, may lag by a flush interval
+    last_login_at = mapped_column(DateTime(timezone=True), nullable=True)
+    last_refresh_at = mapped_column(DateTime(timezone=True), nullable=True)
+    failed_login_count = mapped_column(Integer, nullable=False, server_default="0")  # since the last login
     
     secrets = relationship("Secret", back_populates="users")
 
 
+# immutable copy of a users row, safe to share between requests and sessions
+UserSnapshot = namedtuple("UserSnapshot", [column.key for column in User.__table__.columns])
+
+
+def snapshot_user(user: User) -> UserSnapshot:
+    return UserSnapshot._make(getattr(user, field) for field in UserSnapshot._fields)
+
+
+def user_from_snapshot(snapshot: UserSnapshot) -> User:
+    # a new transient instance per caller, not bound to any session
+    return User(**snapshot._asdict())
+
+
 class Secret(Base):
     __tablename__ = "secrets"
+    __table_args__ = (
+        Index("ix_secrets_created_at_secret", "created_at", "secret"),
+        Index("ix_secrets_unused_created_at_secret", "created_at", "secret", postgresql_where=text("is_used = false")),
+    )
 
     secret = mapped_column(UUID(as_uuid=False), default=uuid_default, primary_key=True)
 
@@ -59,10 +84,21 @@ class Secret(Base):
     #
 
 
+class RevokedToken(Base):
+    """Refresh tokens that were already used, kept until they would have expired anyway."""
+    __tablename__ = "revoked_tokens"
+
+    jti = mapped_column(UUID(as_uuid=False), primary_key=True)
+    user_id = mapped_column(UUID(as_uuid=False), nullable=False)
+    expires_at = mapped_column(DateTime(timezone=True), nullable=False, index=True)
+    revoked_at = mapped_column(DateTime(timezone=True), nullable=False, server_default=func.now(), index=True)
+
+
 class SecretsAdmin(ModelView, model=Secret):
     column_list = [Secret.secret, Secret.created_by, Secret.used_by, Secret.is_used, Secret.created_at]
 
 
 class UsersAdmin(ModelView, model=User):
-    column_list = [User.user_id, User.login, User.name, User.surname, User.used_secret, User.created_at, User.is_active]
+    column_list = [User.user_id, User.login, User.name, User.surname, User.used_secret, User.created_at, User.is_active,
+                   User.last_login_at, User.failed_login_count]
 
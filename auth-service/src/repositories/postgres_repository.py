@@ -1,24 +1,214 @@
+import asyncio
+import contextlib
+import logging
+import time
 import typing
 from abc import ABC, abstractmethod
+from contextvars import ContextVar
+from datetime import datetime
 
 import uuid
 
+import metrics
+from cache import TTLCache
+from singleflight import SingleFlight
 from config import settings
+from fastapi import Depends
 from pydantic import EmailStr
 from repositories import models
-from sqlalchemy import pool, select
-from sqlalchemy.ext.asyncio import (AsyncSession, async_sessionmaker,
+from sqlalchemy import (Boolean, Integer, Select, Table, case, cast, column, delete, event, false, func, insert, literal, pool,
+                        select, text, tuple_, update, values)
+from sqlalchemy import Engine, orm
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import (AsyncEngine, AsyncSession, async_sessionmaker,
                                     create_async_engine)
 
-engine = create_async_engine(settings.database_url, poolclass=pool.AsyncAdaptedQueuePool,
-                             pool_size=8, max_overflow=4, pool_pre_ping=True)
+logger = logging.getLogger(__name__)
+T = typing.TypeVar("T")
+
+POOL_CHECKOUT_SECONDS = metrics.Histogram("db_pool_checkout_seconds",
+                                          "Time to get a pooled connection, including opening a new one")
+REPOSITORY_SECONDS = metrics.Histogram("db_repository_seconds", "Repository method latency", ["method"])
+
+
+class InstrumentedPool(pool.AsyncAdaptedQueuePool):
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_CHECKOUT_SECONDS.observe(time.perf_counter() - started)
+
+
+def _create_engine(url: str) -> AsyncEngine:
+    return create_async_engine(
+        url,
+        poolclass=InstrumentedPool,
+        pool_size=settings.db_pool.size,
+        max_overflow=settings.db_pool.max_overflow,
+        pool_timeout=settings.db_pool.timeout_seconds,
+        pool_recycle=settings.db_pool.recycle_seconds,
+        pool_pre_ping=settings.db_pool.pre_ping,
+        connect_args={"prepared_statement_cache_size": settings.db_pool.prepared_statement_cache_size},
+    )
+
+
+engine = _create_engine(settings.database_url)
+
+metrics.CallbackMetric("db_pool_connections", "Pooled connections by state", lambda: {
+    ("checked_out",): engine.pool.checkedout(),
+    ("checked_in",): engine.pool.checkedin(),
+    ("overflow",): max(engine.pool.overflow(), 0),
+}, ["state"])
+metrics.CallbackMetric("db_pool_size", "Configured pool size, not counting overflow", lambda: engine.pool.size())
+
+
+class ReplicaSet:
+    """Read replicas taken in turn, skipping any that recently failed.
+
+    A replica that cannot be reached is ejected for ``eject_seconds``; see
+    ``read_with_failover``.
+    """
+
+    def __init__(self, engines: list[AsyncEngine], eject_seconds: float):
+        self.async_engines = engines
+        self.engines = [replica.sync_engine for replica in engines]
+        self.eject_seconds = eject_seconds
+        self._next = 0
+        self._ejected_until: dict[Engine, float] = {}
+
+    def choose(self) -> typing.Optional[Engine]:
+        now = time.monotonic()
+        for _ in range(len(self.engines)):
+            replica = self.engines[self._next % len(self.engines)]
+            self._next += 1
+            if self._ejected_until.get(replica, 0) <= now:
+                return replica
+        return None
+
+    def available(self) -> int:
+        now = time.monotonic()
+        return sum(1 for replica in self.engines if self._ejected_until.get(replica, 0) <= now)
+
+    def eject(self, replica: Engine) -> None:
+        self._ejected_until[replica] = time.monotonic() + self.eject_seconds
+
+
+replicas = ReplicaSet([_create_engine(url) for url in settings.db_replicas.urls], settings.db_replicas.eject_seconds)
+
+metrics.CallbackMetric("db_replicas_available", "Read replicas currently in rotation", replicas.available)
+
+READ_ONLY = {"read_only": True}  # bind_arguments for queries a replica may answer
+WROTE = "wrote"  # session.info key, set once the session has sent anything but a SELECT to the primary
+REPLICA = "replica"  # session.info key, the replica chosen for the latest read-only query
+
+
+class RoutingSession(orm.Session):
+    """Sends queries executed with ``bind_arguments=READ_ONLY`` to a replica.
+
+    Everything else goes to the primary, and once a session has written
+    (or run anything other than a plain SELECT) its read-only queries stay on
+    the primary too, so a request always reads its own writes.
+    """
+
+    def get_bind(self, mapper=None, clause=None, read_only: bool = False, **kw):
+        if read_only and not self._flushing and not self.info.get(WROTE):
+            replica = replicas.choose()
+            self.info[REPLICA] = replica
+            if replica is not None:
+                return replica
+        elif self._flushing or not isinstance(clause, Select) or clause._for_update_arg is not None:
+            self.info[WROTE] = True
+        return engine.sync_engine
+
+
+async def read_with_failover(session: AsyncSession, read: typing.Callable[[], typing.Awaitable[T]]) -> T:
+    """Runs a READ_ONLY query, moving on to the next replica, and finally the primary, while replicas fail."""
+    while True:
+        session.info.pop(REPLICA, None)
+        try:
+            return await read()
+        except (OSError, asyncio.TimeoutError, DBAPIError) as e:
+            replica = session.info.pop(REPLICA, None)
+            if replica is None or (isinstance(e, DBAPIError) and not e.connection_invalidated):
+                raise
+            logger.warning("Read replica %s failed, ejecting it: %r", replica.url, e)
+            replicas.eject(replica)
+
 
 Session = async_sessionmaker(
     bind=engine,
     class_=AsyncSession,
+    sync_session_class=RoutingSession,
     expire_on_commit=False)
 
 
+# set per request to count connection checkouts, see main.count_pool_checkouts
+pool_checkouts: ContextVar[list[int] | None] = ContextVar("pool_checkouts", default=None)
+
+
+def _count_checkout(dbapi_connection, connection_record, connection_proxy):
+    counter = pool_checkouts.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+for _engine in [engine.sync_engine, *replicas.engines]:
+    event.listen(_engine, "checkout", _count_checkout)
+
+
+# snapshots of users rows keyed by ("id", user_id), plus ("login", login) -> user_id
+user_cache = TTLCache(settings.user_cache.max_size, settings.user_cache.ttl_seconds) \
+    if settings.user_cache.enabled else None
+STALE_USERS = "stale_users"  # session.info key, users written in the current transaction
+
+user_lookups = SingleFlight()
+
+
+async def _open_connections(pooled: AsyncEngine, connections: int) -> None:
+    async with contextlib.AsyncExitStack() as stack:
+        await asyncio.gather(*(stack.enter_async_context(pooled.connect()) for _ in range(connections)))
+
+
+async def warm_up_pool(connections: int) -> None:
+    """Opens ``connections`` pooled connections to the primary and to every replica at once.
+
+    So the first requests do not pay for connecting. A replica that cannot
+    be reached is ejected rather than failing startup; the primary has to be.
+    """
+    primary, *warmed = await asyncio.gather(
+        _open_connections(engine, connections),
+        *(_open_connections(replica, connections) for replica in replicas.async_engines),
+        return_exceptions=True,
+    )
+    if isinstance(primary, BaseException):
+        raise primary
+    for replica, result in zip(replicas.async_engines, warmed):
+        if isinstance(result, BaseException):
+            logger.warning("Read replica %s could not be warmed up, ejecting it: %r", replica.url, result)
+            replicas.eject(replica.sync_engine)
+
+
+async def primary_is_up(timeout: float) -> bool:
+    """A ``SELECT 1`` through the pool, so it fails when the primary is down or the pool is exhausted."""
+    async def ping():
+        async with engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+
+    try:
+        await asyncio.wait_for(ping(), timeout)
+    except (OSError, asyncio.TimeoutError, DBAPIError) as e:
+        logger.warning("Primary database check failed: %r", e)
+        return False
+    return True
+
+
+async def get_session() -> typing.AsyncIterator[AsyncSession]:
+    async with Session() as session:
+        yield session
+
+
 class AbstractRepository(ABC):
     @abstractmethod
     async def add(self, entity):
@@ -29,51 +219,321 @@ class AbstractRepository(ABC):
         raise NotImplementedError
 
 
+@metrics.time_methods(REPOSITORY_SECONDS)
 class UserRepository(AbstractRepository):
-    def __init__(self):
-        self.session = Session()
+    def __init__(self, session: AsyncSession = Depends(get_session)):
+        self.session = session
 
     async def add(self, entity):
-        async with self.session as session:
-            async with session.begin():
-                session.add(entity)
+        self._invalidate(entity.user_id)
+        self.session.add(entity)
 
-    async def get(self, user_id: str | uuid.UUID) -> typing.Union[models.User, None]:  # works only with PK
-        async with self.session as session:
-            user = await session.get(models.User, user_id)
-            return user
+    async def add_with_secret(self, entity: models.User, secret: str | uuid.UUID) -> bool:
+        """Claims an unused invite secret and inserts the user in one statement.
+
+        Returns False if the secret does not exist or is already used. A taken
+        login raises IntegrityError from the ``login`` unique constraint, and
+        the claim is undone with it.
+        """
+        self._invalidate(entity.user_id)
+        claimed = (
+            update(models.Secret)
+            .where(models.Secret.secret == str(secret), models.Secret.is_used == false())
+            .values(is_used=True, used_by=entity.user_id)
+            .returning(models.Secret.secret)
+            .cte("claimed")
+        )
+        columns = ["user_id", "login", "password", "name", "surname"]
+        values = select(
+            *(literal(getattr(entity, column), getattr(models.User, column).type) for column in columns),
+            claimed.c.secret,
+        )
+        result = await self.session.execute(
+            insert(models.User).from_select([*columns, "used_secret"], values).returning(models.User.user_id)
+        )
+        return result.scalar_one_or_none() is not None
+
+    async def add_many(self, users: typing.Sequence[tuple[str, str, str, str, str, str]],
+                       created_by: str) -> tuple[set[str], set[str]]:
+        """Inserts (user_id, login, password, name, surname, secret) rows, each claiming its secret.
+
+        A secret that does not exist yet is created as ``created_by``'s. Rows
+        whose login is taken are skipped; rows whose secret is already used are
+        not inserted either. Returns (inserted user ids, ids rejected for their
+        secret). Logins and secrets must be unique within ``users``.
+        """
+        columns = ["user_id", "login", "password", "name", "surname", "used_secret"]
+        staging = await create_staging_table(self.session, models.User.__table__, columns)
+        await copy_records(self.session, staging, columns, users)
+        # the users.used_secret foreign key is checked at the end of the statement, after both inserts
+        result = await self.session.execute(text(
+            f"WITH new_users AS ("
+            f"  INSERT INTO users (user_id, login, password, name, surname, used_secret, has_face_id, is_active)"
+            f"  SELECT user_id, login, password, name, surname, used_secret, false, true FROM {staging}"
+            f"  ON CONFLICT (login) DO NOTHING"
+            f"  RETURNING user_id, used_secret"
+            f"), claimed AS ("
+            f"  INSERT INTO secrets (secret, created_by, is_used, used_by)"
+            f"  SELECT used_secret, :created_by, true, user_id FROM new_users"
+            f"  ON CONFLICT (secret) DO UPDATE SET is_used = true, used_by = excluded.used_by"
+            f"  WHERE secrets.is_used IS NOT TRUE"
+            f"  RETURNING used_by"
+            f") "
+            f"SELECT new_users.user_id, claimed.used_by IS NOT NULL "
+            f"FROM new_users LEFT JOIN claimed ON claimed.used_by = new_users.user_id"
+        ), {"created_by": created_by})
+        inserted, rejected = set(), set()
+        for user_id, linked in result:
+            (inserted if linked else rejected).add(str(user_id))
+        if rejected:
+            await self.session.execute(delete(models.User).where(models.User.user_id.in_(rejected)))
+        return inserted, rejected
+
+    async def get(self, user_id: str | uuid.UUID,
+                  for_update: bool = False) -> typing.Union[models.User, None]:  # works only with PK
+        if for_update:
+            # locks the row on the primary until the end of the transaction; never from a replica,
+            # the cache or another session's lookup, for checks that must see the latest commit
+            query = (select(models.User).where(models.User.user_id == str(user_id))
+                     .with_for_update().execution_options(populate_existing=True))
+            return (await self.session.execute(query)).scalar_one_or_none()
+        if user_cache is not None:
+            snapshot = user_cache.get(("id", str(user_id)))
+            if snapshot is not None:
+                return models.user_from_snapshot(snapshot)
+        # AsyncSession.get takes no bind_arguments
+        query = select(models.User).where(models.User.user_id == str(user_id))
+        return await self._select_one(("id", str(user_id)), query)
 
     async def merge(self, entity: models.User) -> None:
-        async with self.session as session:
-            async with session.begin():
-                await session.merge(entity)
+        self._invalidate(entity.user_id)
+        await self.session.merge(entity)
+
+    async def update(self, user_id: str | uuid.UUID, **values) -> None:
+        self._invalidate(user_id)
+        await self.session.execute(
+            update(models.User).where(models.User.user_id == str(user_id)).values(**values)
+        )
+
+    async def update_password(self, user_id: str, old_password: str, new_password: str) -> None:
+        # only replaces the hash it was computed from, a concurrent password change wins
+        self._invalidate(user_id)
+        await self.session.execute(
+            update(models.User)
+            .where(models.User.user_id == user_id, models.User.password == old_password)
+            .values(password=new_password)
+        )
 
     async def get_user_by_login(self, login: str) -> typing.Union[models.User, None]:
-        async with self.session as session:
-            query = select(models.User).where(models.User.login == login)
-            result = await session.execute(query)
-            user = result.scalar_one_or_none()
-            return user
+        if user_cache is not None:
+            user_id = user_cache.get(("login", login))
+            if user_id is not None:
+                return await self.get(user_id)
+        query = select(models.User).where(models.User.login == login)
+        return await self._select_one(("login", login), query)
+
+    async def _select_one(self, key: tuple, query: Select) -> typing.Union[models.User, None]:
+        async def load():
+            result = await read_with_failover(
+                self.session, lambda: self.session.execute(query, bind_arguments=READ_ONLY)
+            )
+            return result.scalar_one_or_none()
+
+        if (self.session.info.get(WROTE) or self.session.info.get(STALE_USERS)
+                or self.session.new or self.session.dirty or self.session.deleted):
+            user = await load()  # has to see this transaction's own writes, cannot share another one's read
+        else:
+            # concurrent lookups of the same user share one query; the caller that ran it
+            # gets the row from its own session, the others a detached copy
+            user, shared = await user_lookups.do(key, load)
+            if shared and user is not None:
+                user = models.user_from_snapshot(models.snapshot_user(user))
+        self._cache(user)
+        return user
+
+    async def record_activity(self, rows: typing.Sequence[tuple]) -> None:
+        """Applies coalesced login activity in one statement.
+
+        Rows are (user_id, last_login_at, last_refresh_at, failed_logins, login_succeeded):
+        timestamps only move forward, and a successful login restarts the
+        failure count from the failures that came after it.
+        """
+        activity = values(
+            column("user_id", models.User.user_id.type),
+            column("last_login_at", models.User.last_login_at.type),
+            column("last_refresh_at", models.User.last_refresh_at.type),
+            column("failed_logins", Integer),
+            column("login_succeeded", Boolean),
+            name="activity",
+        ).data(rows)
+        # NULLs are sent as untyped literals, a column of only NULLs would otherwise be text
+        last_login_at = cast(activity.c.last_login_at, models.User.last_login_at.type)
+        last_refresh_at = cast(activity.c.last_refresh_at, models.User.last_refresh_at.type)
+        await self.session.execute(
+            update(models.User)
+            .where(models.User.user_id == activity.c.user_id)
+            .values(
+                last_login_at=func.greatest(models.User.last_login_at, last_login_at),
+                last_refresh_at=func.greatest(models.User.last_refresh_at, last_refresh_at),
+                failed_login_count=case(
+                    (activity.c.login_succeeded, activity.c.failed_logins),
+                    else_=models.User.failed_login_count + activity.c.failed_logins,
+                ),
+            )
+            .execution_options(synchronize_session=False)
+        )
 
+    def _cache(self, user: typing.Union[models.User, None]) -> None:
+        # never publish rows this transaction has written but not committed yet
+        if user_cache is None or user is None or user.user_id in self.session.info.get(STALE_USERS, ()):
+            return
+        user_cache.set(("id", user.user_id), models.snapshot_user(user))
+        user_cache.set(("login", user.login), user.user_id)
 
+    def _invalidate(self, user_id: str | uuid.UUID) -> None:
+        if user_cache is not None:
+            user_cache.pop(("id", str(user_id)))
+            # dropped again on commit, in case a concurrent request cached the old row meanwhile
+            self.session.info.setdefault(STALE_USERS, set()).add(str(user_id))
+
+
+@metrics.time_methods(REPOSITORY_SECONDS)
 class SecretRepository(AbstractRepository):
-    def __init__(self):
-        self.session = Session()
+    def __init__(self, session: AsyncSession = Depends(get_session)):
+        self.session = session
 
     async def add(self, entity):
-        async with self.session as session:
-            async with session.begin():
-                session.add(entity)
+        self.session.add(entity)
 
     async def get(self, secret_id) -> typing.Union[models.Secret, None]:
-        async with self.session as session:
-            async with session.begin():
-                secret = await session.get(models.Secret, secret_id)
-                return secret
-
-    async def get_secrets(self):
-        async with self.session as session:
-            query = select(models.Secret)
-            result = await session.execute(query)
-            secrets = result.scalars().all()
-            return secrets
+        secret = await self.session.get(models.Secret, secret_id)
+        return secret
+
+    async def add_many(self, rows: typing.AsyncIterable[list[tuple[str, str]]]) -> tuple[int, int]:
+        """Inserts batches of (secret, created_by) rows, skipping secrets that already exist.
+
+        Returns (received, inserted). Everything happens in the session's
+        transaction, so a failed import leaves nothing behind.
+        """
+        staging = await create_staging_table(self.session, models.Secret.__table__, ["secret", "created_by"])
+        received = 0
+        async for batch in rows:
+            await copy_records(self.session, staging, ["secret", "created_by"], batch)
+            received += len(batch)
+        result = await self.session.execute(text(
+            f"INSERT INTO secrets (secret, created_by) "
+            f"SELECT DISTINCT ON (secret) secret, created_by FROM {staging} "
+            f"ON CONFLICT (secret) DO NOTHING"
+        ))
+        return received, result.rowcount
+
+    async def get_secrets(self, limit: int, after: typing.Optional[tuple[datetime, str]] = None,
+                          is_used: typing.Optional[bool] = None,
+                          created_by: typing.Optional[str] = None) -> typing.Sequence[models.Secret]:
+        query = secrets_query(after, is_used, created_by).limit(limit)
+        result = await read_with_failover(
+            self.session, lambda: self.session.execute(query, bind_arguments=READ_ONLY)
+        )
+        secrets = result.scalars().all()
+        return secrets
+
+
+@metrics.time_methods(REPOSITORY_SECONDS)
+class RevokedTokenRepository(AbstractRepository):
+    def __init__(self, session: AsyncSession = Depends(get_session)):
+        self.session = session
+
+    async def add(self, entity: models.RevokedToken) -> bool:
+        """Revokes a token; False if it was already revoked, i.e. the token is being reused."""
+        result = await self.session.execute(
+            pg_insert(models.RevokedToken)
+            .values(jti=entity.jti, user_id=entity.user_id, expires_at=entity.expires_at)
+            .on_conflict_do_nothing(index_elements=[models.RevokedToken.jti])
+            .returning(models.RevokedToken.jti)
+        )
+        return result.scalar_one_or_none() is not None
+
+    async def get(self, jti: str) -> typing.Union[models.RevokedToken, None]:
+        return await self.session.get(models.RevokedToken, jti)
+
+    async def stream_unexpired(self, revoked_since: typing.Optional[datetime] = None,
+                               batch_size: int = 10_000) -> typing.AsyncIterator[tuple[str, datetime, datetime]]:
+        """(jti, expires_at, revoked_at) of unexpired revocations, read batch_size rows at a time."""
+        query = (select(models.RevokedToken.jti, models.RevokedToken.expires_at, models.RevokedToken.revoked_at)
+                 .where(models.RevokedToken.expires_at > func.now()))
+        if revoked_since is not None:
+            query = query.where(models.RevokedToken.revoked_at >= revoked_since)
+        result = await self.session.stream(query.execution_options(yield_per=batch_size))
+        async for row in result:
+            yield row
+
+    async def delete_expired(self) -> int:
+        result = await self.session.execute(
+            delete(models.RevokedToken).where(models.RevokedToken.expires_at <= func.now())
+        )
+        return result.rowcount
+
+
+def secrets_query(after: typing.Optional[tuple[datetime, str]] = None, is_used: typing.Optional[bool] = None,
+                  created_by: typing.Optional[str] = None) -> Select:
+    """Secrets in (created_at, secret) order, starting right after the ``after`` key."""
+    query = select(models.Secret).order_by(models.Secret.created_at, models.Secret.secret)
+    if after is not None:
+        key = tuple_(models.Secret.created_at, models.Secret.secret)
+        query = query.where(key > tuple_(*after, types=[models.Secret.created_at.type, models.Secret.secret.type]))
+    if is_used is not None:
+        query = query.where(models.Secret.is_used == is_used)
+    if created_by is not None:
+        query = query.where(models.Secret.created_by == created_by)
+    return query
+
+
+async def stream_secrets(query: Select, batch_size: int = 500) -> typing.AsyncIterator[models.Secret]:
+    # a response body is streamed after the request session is closed, so this opens its own;
+    # asyncpg reads through a server-side cursor, batch_size rows at a time
+    async with Session() as session:
+        result = await read_with_failover(session, lambda: session.stream_scalars(
+            query.execution_options(yield_per=batch_size), bind_arguments=READ_ONLY
+        ))
+        async for secret in result:
+            yield secret
+
+
+async def create_staging_table(session: AsyncSession, table: Table, columns: list[str]) -> str:
+    """A temporary table for COPY with the given columns of ``table``, dropped on commit."""
+    name = f"{table.name}_staging_{uuid.uuid4().hex[:8]}"
+    definitions = ", ".join(f"{column} {table.c[column].type.compile(engine.dialect)}" for column in columns)
+    await session.execute(text(f"CREATE TEMPORARY TABLE {name} ({definitions}) ON COMMIT DROP"))
+    return name
+
+
+async def copy_records(session: AsyncSession, table: str, columns: list[str],
+                       records: typing.Sequence[tuple]) -> None:
+    # COPY is not part of SQLAlchemy, go down to the asyncpg connection of this session
+    connection = await session.connection()
+    raw_connection = await connection.get_raw_connection()
+    await raw_connection.driver_connection.copy_records_to_table(table, records=records, columns=columns)
+
+
+class UnitOfWork:
+    """Repositories sharing one session, and so one connection and one transaction.
+
+    Repository writes are staged in the session; nothing is persisted until ``commit``.
+    Within a request every dependency receives the same session, so
+    ``Depends(UserRepository)`` and ``Depends(UnitOfWork)`` can be mixed freely.
+    """
+
+    def __init__(self, session: AsyncSession = Depends(get_session)):
+        self.session = session
+        self.users = UserRepository(session)
+        self.secrets = SecretRepository(session)
+        self.revoked_tokens = RevokedTokenRepository(session)
+
+    async def commit(self) -> None:
+        await self.session.commit()
+        for user_id in self.session.info.pop(STALE_USERS, ()):
+            user_cache.pop(("id", user_id))
+
+    async def rollback(self) -> None:
+        await self.session.rollback()
+        self.session.info.pop(STALE_USERS, None)
@@ -0,0 +1,56 @@
+import asyncio
+import typing
+
+T = typing.TypeVar("T")
+
+
+class SingleFlight:
+    """Runs one call per key at a time; concurrent callers with the same key share its outcome.
+
+    ``do`` returns ``(result, shared)``, ``shared`` being False for the caller
+    that ran the call and True for the ones that waited on it. Exceptions are
+    shared the same way. If the running caller is cancelled, the waiting
+    ones start over instead of inheriting the cancellation.
+    """
+
+    def __init__(self):
+        self._in_flight: dict[typing.Hashable, asyncio.Future] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._in_flight)
+
+    async def do(self, key: typing.Hashable, fn: typing.Callable[[], typing.Awaitable[T]]) -> tuple[T, bool]:
+        while True:
+            future = self._in_flight.get(key)
+            if future is None:
+                break
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(future), True
+            except asyncio.CancelledError:
+                if not future.cancelled() or asyncio.current_task().cancelling():
+                    raise
+                # the running caller was cancelled, not us: try again
+
+        self.calls += 1
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # retrieved, even if nobody was waiting
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            del self._in_flight[key]
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._in_flight)}
@@ -0,0 +1,49 @@
+"""Run from auth-service/: ``pip install -r requirements/test.txt && python -m pytest``.
+
+Tests marked ``postgres`` need a database migrated to head (``alembic
+upgrade head``), configured with the same DB_* variables as the service;
+they are skipped when DB_NAME is not set.
+"""
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+POSTGRES = "DB_NAME" in os.environ
+
+# enough for the modules to import; nothing connects until a test does
+for name, value in {
+    "DB_DIALECT": "postgresql", "DB_ASYNC_DRIVER": "asyncpg", "DB_HOST": "localhost", "DB_PORT": "5432",
+    "DB_NAME": "papper", "DB_USER": "postgres", "DB_PASSWORD": "postgres", "DB_CONTAINER_PORT": "5432",
+    "DOMAIN": "localhost", "HOST_PORT": "8000", "IS_TESTING": "false",
+}.items():
+    os.environ.setdefault(name, value)
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "postgres: needs a migrated Postgres, see conftest.py")
+
+
+def pytest_collection_modifyitems(config, items):
+    if POSTGRES:
+        return
+    skip = pytest.mark.skip(reason="DB_NAME is not set")
+    for item in items:
+        if "postgres" in item.keywords:
+            item.add_marker(skip)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def db():
+    # connections belong to the event loop of the test that opened them
+    from repositories.postgres_repository import engine
+    yield
+    await engine.dispose()
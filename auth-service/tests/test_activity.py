@@ -0,0 +1,27 @@
+import logging
+
+import pytest
+
+from auth import activity
+
+pytestmark = pytest.mark.anyio
+
+
+class UnreachableSession:
+    async def __aenter__(self):
+        raise OSError("connection refused")
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+async def test_close_logs_a_failed_final_flush_instead_of_raising(monkeypatch, caplog):
+    monkeypatch.setattr(activity, "Session", UnreachableSession)
+    recorder = activity.ActivityRecorder(enabled=True, flush_interval_seconds=60, max_pending=100, batch_size=10)
+    recorder.start()
+    recorder.login_succeeded("5f0c6b8e-2b4e-4d4a-9d7e-0c1f2a3b4c5d")
+
+    with caplog.at_level(logging.ERROR, logger=activity.logger.name):
+        await recorder.close()
+
+    assert "1 users not recorded" in caplog.text
@@ -0,0 +1,39 @@
+import types
+
+import pytest
+
+from auth import passwords, utils
+from config import settings
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeUnitOfWork:
+    def __init__(self, user=None):
+        self.users = types.SimpleNamespace(get_user_by_login=self._get_user_by_login)
+        self.user = user
+
+    async def _get_user_by_login(self, login):
+        return self.user
+
+    async def commit(self):
+        pass
+
+
+@pytest.fixture
+def verified(monkeypatch):
+    calls = []
+    verify = passwords.verify_password
+
+    def counting_verify(password, hashed_password):
+        calls.append(hashed_password)
+        return verify(password, hashed_password)
+
+    monkeypatch.setattr(passwords, "verify_password", counting_verify)
+    return calls
+
+
+async def test_unknown_logins_cost_a_password_verification(verified):
+    assert await utils.authenticate_user("nobody", "password", FakeUnitOfWork()) is False
+    assert len(verified) == 1
+    assert not passwords.needs_rehash(verified[0], settings.password_hashing)
@@ -0,0 +1,33 @@
+import io
+import uuid
+
+import pytest
+from fastapi import UploadFile
+
+from auth import bulk
+
+pytestmark = pytest.mark.anyio
+
+SECRETS = [str(uuid.UUID(int=number)) for number in range(1, 40)]
+CSV = "\ufeffsecret,created_by\r\n" + "".join(
+    f"{secret},{'owner' if number % 3 else ''}\r\n" + ("\r\n" if number % 7 == 0 else "")
+    for number, secret in enumerate(SECRETS)
+) + SECRETS[0]  # no newline at the end
+
+
+async def read_upload(data: bytes, chunk_size: int) -> list[tuple[str, str]]:
+    return [row async for row in bulk.read_secrets_upload(UploadFile(io.BytesIO(data)), "admin", chunk_size)]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 100_000])
+async def test_upload_reads_like_the_csv_reader_whatever_the_chunk_size(chunk_size):
+    expected = list(bulk.read_secrets_csv(io.StringIO(CSV.removeprefix("\ufeff"), newline=""), "admin"))
+    assert len(expected) == len(SECRETS) + 1
+    assert await read_upload(CSV.encode("utf-8"), chunk_size) == expected
+
+
+@pytest.mark.parametrize("chunk_size", [1, 64])
+async def test_upload_errors_name_the_line(chunk_size):
+    data = f"{SECRETS[0]}\n\nnot a secret\n".encode()
+    with pytest.raises(ValueError, match="Line 3"):
+        await read_upload(data, chunk_size)
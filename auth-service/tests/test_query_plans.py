@@ -0,0 +1,117 @@
+"""EXPLAIN the statements the repositories send and check they are served by the intended index.
+
+Tables are seeded and analyzed in a transaction that is rolled back at the end.
+"""
+import typing
+import uuid
+
+import pytest
+from sqlalchemy import event, select, text
+
+from repositories import models
+from repositories.postgres_repository import Session, UnitOfWork, engine
+
+pytestmark = [pytest.mark.anyio, pytest.mark.postgres]
+
+SECRETS = 20_000
+USERS = 5_000
+EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+
+
+@pytest.fixture
+async def uow(db):
+    async with Session() as session:
+        uow = UnitOfWork(session)
+        tag = f"test-{uuid.uuid4().hex[:8]}"
+        secrets = [str(uuid.uuid4()) for _ in range(SECRETS)]
+
+        async def batches():
+            yield [(secret, tag) for secret in secrets]
+
+        await uow.secrets.add_many(batches())
+        await uow.users.add_many([(str(uuid.uuid4()), f"{tag}-{number}", "x", "Test", "Test", secret)
+                                  for number, secret in enumerate(secrets[:USERS])], tag)
+        await session.execute(text("ANALYZE secrets"))
+        await session.execute(text("ANALYZE users"))
+        uow.unused_secret = secrets[-1]
+        uow.used_secret = secrets[0]
+        uow.login = f"{tag}-0"
+        try:
+            yield uow
+        finally:
+            await session.rollback()
+
+
+async def explain(uow: UnitOfWork, call: typing.Callable[[], typing.Awaitable]) -> list[dict]:
+    """Runs ``call`` and returns the plans of the statements it sent, without their side effects."""
+    connection = await uow.session.connection()
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if conn is connection.sync_connection and statement.lstrip().upper().startswith(EXPLAINABLE):
+            statements.append((statement, parameters))
+
+    savepoint = await uow.session.begin_nested()
+    event.listen(engine.sync_engine, "before_cursor_execute", capture)
+    try:
+        await call()
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", capture)
+        await savepoint.rollback()
+
+    plans = []
+    for statement, parameters in statements:
+        result = await connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", parameters)
+        plans.append(result.scalar_one()[0]["Plan"])
+    return plans
+
+
+def scans(plan: dict) -> typing.Iterator[tuple[str, str, typing.Optional[str]]]:
+    """(node type, relation, index) of every scan in the plan."""
+    if "Relation Name" in plan:
+        yield plan["Node Type"], plan["Relation Name"], plan.get("Index Name")
+    for child in plan.get("Plans", ()):
+        yield from scans(child)
+
+
+def assert_uses_index(plans: list[dict], relation: str, index: str) -> None:
+    found = [scan for plan in plans for scan in scans(plan) if scan[1] == relation]
+    assert found, f"no scan of {relation}"
+    assert all(node != "Seq Scan" for node, _, _ in found), found
+    assert any(name == index for _, _, name in found), found
+
+
+async def test_secrets_listing_uses_the_created_at_index(uow):
+    plans = await explain(uow, lambda: uow.secrets.get_secrets(100))
+    assert_uses_index(plans, "secrets", "ix_secrets_created_at_secret")
+
+
+async def test_secrets_listing_after_a_cursor_uses_the_created_at_index(uow):
+    [first] = await uow.secrets.get_secrets(1)
+    plans = await explain(uow, lambda: uow.secrets.get_secrets(100, after=(first.created_at, first.secret)))
+    assert_uses_index(plans, "secrets", "ix_secrets_created_at_secret")
+
+
+async def test_unused_secrets_listing_uses_the_partial_index(uow):
+    plans = await explain(uow, lambda: uow.secrets.get_secrets(100, is_used=False))
+    assert_uses_index(plans, "secrets", "ix_secrets_unused_created_at_secret")
+
+
+async def test_registration_claims_the_secret_by_key(uow):
+    user = models.User(user_id=str(uuid.uuid4()), login=f"{uow.login}-new", password="x", name="Test",
+                       surname="Test")
+    plans = await explain(uow, lambda: uow.users.add_with_secret(user, uow.unused_secret))
+    assert_uses_index(plans, "secrets", "secrets_pkey")
+
+
+async def test_users_by_secret_use_the_used_secret_index(uow):
+    # what Secret.users and the users -> secrets foreign key look up
+    query = select(models.User).where(models.User.used_secret == uow.used_secret)
+    plans = await explain(uow, lambda: uow.session.execute(query))
+    assert_uses_index(plans, "users", "ix_users_used_secret")
+
+
+async def test_users_by_login_use_the_unique_index(uow):
+    plans = await explain(uow, lambda: uow.users.get_user_by_login(uow.login))
+    assert_uses_index(plans, "users", "users_login_key")
+
@@ -0,0 +1,46 @@
+import pytest
+from fastapi import HTTPException, Request
+
+from auth.rate_limit import InMemoryRateLimitStore, LoginRateLimiter
+from config import LoginRateLimit
+
+pytestmark = pytest.mark.anyio
+
+PROXIES = ["172.16.0.0/12", "10.0.0.1"]
+
+
+def request(peer: str, forwarded: str = None) -> Request:
+    headers = [(b"x-forwarded-for", forwarded.encode())] if forwarded is not None else []
+    return Request({"type": "http", "client": (peer, 50000), "headers": headers})
+
+
+def limiter(**config) -> LoginRateLimiter:
+    return LoginRateLimiter(InMemoryRateLimitStore(1000), LoginRateLimit(**config))
+
+
+def test_client_addresses_are_not_used_without_trusted_proxies():
+    assert limiter().client_ip(request("203.0.113.7")) is None
+    assert limiter(trusted_proxies=PROXIES).client_ip(request("172.18.0.2", "203.0.113.7")) is None
+    assert limiter(trust_forwarded_for=True).client_ip(request("172.18.0.2", "203.0.113.7")) is None
+
+
+@pytest.mark.parametrize("peer, forwarded, client", [
+    ("172.18.0.2", "203.0.113.7", "203.0.113.7"),
+    ("172.18.0.2", "198.51.100.1, 203.0.113.7, 10.0.0.1", "203.0.113.7"),  # first hop is client-supplied
+    ("203.0.113.7", "198.51.100.1", "203.0.113.7"),  # not through our proxy, the header is ignored
+    ("172.18.0.2", None, None),  # the proxy itself
+    ("172.18.0.2", "10.0.0.1", None),
+])
+def test_client_address_is_the_first_hop_not_added_by_a_trusted_proxy(peer, forwarded, client):
+    trusting = limiter(trust_forwarded_for=True, trusted_proxies=PROXIES)
+    assert trusting.client_ip(request(peer, forwarded)) == client
+
+
+async def test_clients_behind_the_proxy_do_not_share_a_bucket():
+    trusting = limiter(trust_forwarded_for=True, trusted_proxies=PROXIES, per_ip_burst=2, per_login_burst=100)
+    for login in ("a", "b"):
+        await trusting.check(request("172.18.0.2", "203.0.113.7"), login)
+    await trusting.check(request("172.18.0.2", "203.0.113.8"), "c")
+    with pytest.raises(HTTPException) as error:
+        await trusting.check(request("172.18.0.2", "203.0.113.7"), "d")
+    assert error.value.status_code == 429
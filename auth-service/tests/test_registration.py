@@ -0,0 +1,79 @@
+"""Registration checks that run before the password is hashed, against Postgres."""
+import uuid
+
+import httpx
+import pytest
+from sqlalchemy import delete
+
+from auth import bulk, utils
+from auth.rate_limit import login_rate_limiter
+from main import app
+from repositories import models
+from repositories.postgres_repository import Session, UnitOfWork
+
+pytestmark = [pytest.mark.anyio, pytest.mark.postgres]
+
+
+@pytest.fixture
+async def tag(db):
+    tag = f"test-{uuid.uuid4().hex[:8]}"
+    yield tag
+    async with Session() as session:
+        await session.execute(delete(models.User).where(models.User.login.like(f"{tag}-%")))
+        await session.execute(delete(models.Secret).where(models.Secret.created_by == tag))
+        await session.commit()
+
+
+@pytest.fixture
+def hashed(monkeypatch):
+    calls = []
+    hash_password = utils.hash_password
+
+    async def counting_hash(password):
+        calls.append(password)
+        return await hash_password(password)
+
+    monkeypatch.setattr(utils, "hash_password", counting_hash)
+    return calls
+
+
+@pytest.fixture
+async def client():
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+
+
+def register(client: httpx.AsyncClient, secret: str, login: str):
+    return client.post("/personal/registration", json={"secret": secret, "login": login, "password": "password",
+                                                       "name": "Test", "surname": "Test"})
+
+
+async def create_secrets(tag: str, count: int) -> list[str]:
+    secrets = bulk.generate_secrets(count)
+    async with Session() as session:
+        await bulk.import_secrets(UnitOfWork(session), ((secret, tag) for secret in secrets))
+    return secrets
+
+
+async def test_invalid_secrets_are_rejected_before_hashing(tag, client, hashed):
+    [secret] = await create_secrets(tag, 1)
+    assert (await register(client, str(uuid.uuid4()), f"{tag}-unknown")).status_code == 401
+    assert (await register(client, secret, f"{tag}-first")).status_code == 200
+    assert (await register(client, secret, f"{tag}-second")).status_code == 401
+    assert len(hashed) == 1
+
+
+async def test_taken_logins_are_rejected_before_hashing(tag, client, hashed):
+    first, second = await create_secrets(tag, 2)
+    assert (await register(client, first, f"{tag}-login")).status_code == 200
+    assert (await register(client, second, f"{tag}-login")).status_code == 409
+    assert len(hashed) == 1
+
+
+async def test_registrations_are_rate_limited_per_login(tag, client, hashed):
+    attempts = [(await register(client, str(uuid.uuid4()), f"{tag}-limited")).status_code
+                for _ in range(login_rate_limiter.config.per_login_burst + 1)]
+    assert attempts[-1] == 429
+    assert set(attempts[:-1]) == {401}
+    assert not hashed
@@ -0,0 +1,93 @@
+"""Concurrent registrations racing for one secret or one login, against Postgres."""
+import asyncio
+import uuid
+
+import httpx
+import pytest
+from sqlalchemy import delete, select
+
+from auth import bulk
+from auth.rate_limit import login_rate_limiter
+from main import app
+from repositories import models
+from repositories.postgres_repository import Session, UnitOfWork
+
+pytestmark = [pytest.mark.anyio, pytest.mark.postgres]
+
+CLIENTS = 20
+
+
+@pytest.fixture(autouse=True)
+def no_rate_limit(monkeypatch):
+    # twenty attempts at one login would otherwise run into the per-login bucket
+    monkeypatch.setattr(login_rate_limiter.config, "enabled", False)
+
+
+@pytest.fixture
+async def tag(db):
+    tag = f"test-{uuid.uuid4().hex[:8]}"
+    yield tag
+    async with Session() as session:
+        await session.execute(delete(models.User).where(models.User.login.like(f"{tag}-%")))
+        await session.execute(delete(models.Secret).where(models.Secret.created_by == tag))
+        await session.commit()
+
+
+async def create_secrets(tag: str, count: int) -> list[str]:
+    secrets = bulk.generate_secrets(count)
+    async with Session() as session:
+        await bulk.import_secrets(UnitOfWork(session), ((secret, tag) for secret in secrets))
+    return secrets
+
+
+async def register_all(requests: list[tuple[str, str]]) -> list[int]:
+    """Sends every (secret, login) registration at once, returns the status codes in order."""
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        responses = await asyncio.gather(*(
+            client.post("/personal/registration", json={"secret": secret, "login": login, "password": "password",
+                                                        "name": "Test", "surname": "Test"})
+            for secret, login in requests
+        ))
+    return [response.status_code for response in responses]
+
+
+async def secrets_by_id(secrets: list[str]) -> dict[str, models.Secret]:
+    async with Session() as session:
+        result = await session.execute(select(models.Secret).where(models.Secret.secret.in_(secrets)))
+        return {secret.secret: secret for secret in result.scalars()}
+
+
+async def user_ids(logins: list[str]) -> dict[str, str]:
+    async with Session() as session:
+        result = await session.execute(select(models.User.login, models.User.user_id)
+                                       .where(models.User.login.in_(logins)))
+        return dict(result.all())
+
+
+async def test_one_secret_is_claimed_once(tag):
+    [secret] = await create_secrets(tag, 1)
+    logins = [f"{tag}-{number}" for number in range(CLIENTS)]
+
+    statuses = await register_all([(secret, login) for login in logins])
+
+    assert sorted(statuses) == [200] + [401] * (CLIENTS - 1)
+    winner = logins[statuses.index(200)]
+    registered = await user_ids(logins)
+    assert list(registered) == [winner]
+    claimed = (await secrets_by_id([secret]))[secret]
+    assert claimed.is_used and claimed.used_by == registered[winner]
+
+
+async def test_one_login_is_registered_once(tag):
+    secrets = await create_secrets(tag, CLIENTS)
+    login = f"{tag}-login"
+
+    statuses = await register_all([(secret, login) for secret in secrets])
+
+    assert sorted(statuses) == [200] + [409] * (CLIENTS - 1)
+    winning_secret = secrets[statuses.index(200)]
+    user_id = (await user_ids([login]))[login]
+    rows = await secrets_by_id(secrets)
+    assert [secret for secret, row in rows.items() if row.is_used] == [winning_secret]
+    assert rows[winning_secret].used_by == user_id
@@ -0,0 +1,54 @@
+import time
+import uuid
+
+from auth.revocation import BUCKET_SECONDS, COMPACT_MIN, RevocationStore
+
+
+def jtis(count: int) -> list[str]:
+    return [str(uuid.uuid4()) for _ in range(count)]
+
+
+def test_revoked_tokens_are_found_by_jti_and_exp():
+    store = RevocationStore(max_tokens=1000)
+    exp = time.time() + 3600
+    revoked, other = jtis(2)
+    store.add(revoked, exp)
+
+    assert store.is_revoked(revoked, exp)
+    assert not store.is_revoked(other, exp)
+    assert not store.is_revoked(revoked, exp + 7 * BUCKET_SECONDS)  # another bucket
+
+
+def test_lookups_survive_compaction():
+    store = RevocationStore(max_tokens=100_000)
+    exp = time.time() + 3600
+    revoked = jtis(COMPACT_MIN * 10 + 3)
+    for jti in revoked:
+        store.add(jti, exp)
+    store.add(revoked[0], exp)  # twice
+
+    assert len(store) == len(revoked)
+    assert all(store.is_revoked(jti, exp) for jti in revoked)
+    assert not any(store.is_revoked(jti, exp) for jti in jtis(1000))
+
+
+def test_expired_tokens_are_not_kept():
+    store = RevocationStore(max_tokens=1000)
+    [expired] = jtis(1)
+    store.add(expired, time.time() - 1)
+    assert len(store) == 0
+
+
+def test_buckets_expiring_soonest_are_dropped_beyond_max_tokens():
+    store = RevocationStore(max_tokens=10)
+    soon, later = time.time() + BUCKET_SECONDS, time.time() + 5 * BUCKET_SECONDS
+    early, late = jtis(6), jtis(6)
+    for jti in early:
+        store.add(jti, soon)
+    for jti in late:
+        store.add(jti, later)
+    store.prune()
+
+    assert len(store) == 6
+    assert all(store.is_revoked(jti, later) for jti in late)
+    assert not any(store.is_revoked(jti, soon) for jti in early)
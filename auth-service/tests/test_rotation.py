@@ -0,0 +1,79 @@
+"""Refresh-token rotation through /personal/refresh, against Postgres."""
+import asyncio
+import uuid
+
+import httpx
+import pytest
+from fastapi import HTTPException, status
+from sqlalchemy import delete, select
+
+from auth import utils
+from auth.executor import signing_executor
+from main import app
+from repositories import models
+from repositories.postgres_repository import Session
+
+pytestmark = [pytest.mark.anyio, pytest.mark.postgres]
+
+
+@pytest.fixture
+async def user(db):
+    user = models.User(user_id=str(uuid.uuid4()), login=f"test-{uuid.uuid4().hex[:8]}", password="x",
+                       name="Test", surname="Test", token_version=0)
+    async with Session() as session:
+        session.add(user)
+        await session.commit()
+    yield user
+    async with Session() as session:
+        await session.execute(delete(models.RevokedToken).where(models.RevokedToken.user_id == user.user_id))
+        await session.execute(delete(models.User).where(models.User.user_id == user.user_id))
+        await session.commit()
+
+
+@pytest.fixture
+async def client():
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+
+
+def refresh(client: httpx.AsyncClient, refresh_token: str):
+    return client.post("/personal/refresh", json={"refresh_token": refresh_token})
+
+
+async def token_version(user: models.User) -> int:
+    async with Session() as session:
+        return await session.scalar(select(models.User.token_version).where(models.User.user_id == user.user_id))
+
+
+async def test_a_failed_mint_does_not_spend_the_refresh_token(user, client, monkeypatch):
+    tokens = await utils.get_access_and_refresh_tokens(user)
+    run = signing_executor.run
+
+    async def busy_once(fn, *args):
+        monkeypatch.setattr(signing_executor, "run", run)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, try again later",
+            headers={"Retry-After": "1"},
+        )
+
+    monkeypatch.setattr(signing_executor, "run", busy_once)
+    busy = await refresh(client, tokens.refresh_token)
+    assert busy.status_code == 503
+
+    retry = await refresh(client, tokens.refresh_token)
+    assert retry.status_code == 200
+    assert await token_version(user) == 0
+    assert (await refresh(client, retry.json()["refresh_token"])).status_code == 200
+
+
+async def test_a_token_presented_twice_at_once_revokes_the_family(user, client):
+    tokens = await utils.get_access_and_refresh_tokens(user)
+
+    responses = await asyncio.gather(refresh(client, tokens.refresh_token), refresh(client, tokens.refresh_token))
+
+    assert sorted(response.status_code for response in responses) == [200, 401]
+    assert await token_version(user) == 1
+    [winner] = [response for response in responses if response.status_code == 200]
+    assert (await refresh(client, winner.json()["refresh_token"])).status_code == 401
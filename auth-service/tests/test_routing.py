@@ -0,0 +1,171 @@
+import contextlib
+import types
+
+import pytest
+from sqlalchemy import select, update
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from repositories import models, postgres_repository
+from repositories.postgres_repository import (READ_ONLY, REPLICA, WROTE, ReplicaSet, RoutingSession,
+                                              primary_is_up, read_with_failover, warm_up_pool)
+
+
+class FakeEngine:
+    def __init__(self, name: str):
+        self.url = name
+        self.sync_engine = self
+        self.reachable = True
+        self.connected = 0
+
+    @contextlib.asynccontextmanager
+    async def connect(self):
+        if not self.reachable:
+            raise OSError("connection refused")
+        self.connected += 1
+        yield types.SimpleNamespace(execute=self._execute)
+
+    async def _execute(self, statement):
+        pass
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(postgres_repository.time, "monotonic", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def replicas(monkeypatch, clock):
+    replica_set = ReplicaSet([FakeEngine("replica-1"), FakeEngine("replica-2"), FakeEngine("replica-3")],
+                             eject_seconds=30)
+    monkeypatch.setattr(postgres_repository, "replicas", replica_set)
+    return replica_set
+
+
+@pytest.fixture
+def primary(monkeypatch):
+    engine = FakeEngine("primary")
+    monkeypatch.setattr(postgres_repository, "engine", engine)
+    return engine
+
+
+def read_bind(session: RoutingSession):
+    return session.get_bind(clause=select(models.User), **READ_ONLY)
+
+
+def test_reads_go_round_robin_over_replicas(replicas, primary):
+    session = RoutingSession()
+    assert [read_bind(session).url for _ in range(4)] == ["replica-1", "replica-2", "replica-3", "replica-1"]
+    assert session.get_bind(clause=select(models.User)) is primary
+
+
+def test_ejected_replicas_are_skipped_until_they_are_due(replicas, primary, clock):
+    session = RoutingSession()
+    replicas.eject(replicas.engines[1])
+    assert [read_bind(session).url for _ in range(3)] == ["replica-1", "replica-3", "replica-1"]
+    assert replicas.available() == 2
+
+    clock[0] += 30
+    assert replicas.available() == 3
+
+
+def test_reads_fall_back_to_the_primary_when_every_replica_is_ejected(replicas, primary):
+    session = RoutingSession()
+    for replica in replicas.engines:
+        replicas.eject(replica)
+    assert read_bind(session) is primary
+    assert session.info[REPLICA] is None
+
+
+def test_session_stays_on_the_primary_once_it_has_written(replicas, primary):
+    session = RoutingSession()
+    assert read_bind(session) is not primary
+    assert session.get_bind(clause=update(models.User).values(is_active=True)) is primary
+    assert session.info[WROTE]
+    assert all(read_bind(session) is primary for _ in range(3))
+
+
+def test_locking_reads_keep_the_session_on_the_primary(replicas, primary):
+    session = RoutingSession()
+    assert session.get_bind(clause=select(models.User).with_for_update()) is primary
+    assert read_bind(session) is primary
+
+
+def make_session() -> AsyncSession:
+    return AsyncSession(sync_session_class=RoutingSession)
+
+
+def failing_read(session: AsyncSession, failing: set[str], error: Exception = OSError("connection refused")):
+    binds = []
+
+    async def read():
+        bind = read_bind(session.sync_session)
+        binds.append(bind.url)
+        if bind.url in failing:
+            raise error
+        return bind.url
+
+    return read, binds
+
+
+@pytest.mark.anyio
+async def test_failover_ejects_the_failed_replica_and_uses_the_next(replicas, primary):
+    session = make_session()
+    read, binds = failing_read(session, {"replica-1"})
+    assert await read_with_failover(session, read) == "replica-2"
+    assert binds == ["replica-1", "replica-2"]
+    assert replicas.available() == 2
+
+
+@pytest.mark.anyio
+async def test_failover_ends_on_the_primary(replicas, primary):
+    session = make_session()
+    read, binds = failing_read(session, {"replica-1", "replica-2", "replica-3"})
+    assert await read_with_failover(session, read) == "primary"
+    assert binds == ["replica-1", "replica-2", "replica-3", "primary"]
+    assert replicas.available() == 0
+
+
+@pytest.mark.anyio
+async def test_primary_errors_are_not_retried(replicas, primary):
+    session = make_session()
+    session.info[WROTE] = True
+    read, binds = failing_read(session, {"primary"})
+    with pytest.raises(OSError):
+        await read_with_failover(session, read)
+    assert binds == ["primary"]
+
+
+@pytest.mark.anyio
+async def test_query_errors_on_a_replica_are_not_failed_over(replicas, primary):
+    session = make_session()
+    error = DBAPIError("SELECT", {}, types.SimpleNamespace(), connection_invalidated=False)
+    read, binds = failing_read(session, {"replica-1"}, error)
+    with pytest.raises(DBAPIError):
+        await read_with_failover(session, read)
+    assert binds == ["replica-1"]
+    assert replicas.available() == 3
+
+
+@pytest.mark.anyio
+async def test_warm_up_opens_connections_to_every_pool_and_ejects_unreachable_replicas(replicas, primary):
+    replicas.engines[1].reachable = False
+    await warm_up_pool(4)
+    assert [pooled.connected for pooled in (primary, *replicas.engines)] == [4, 4, 0, 4]
+    assert replicas.available() == 2
+
+
+@pytest.mark.anyio
+async def test_warm_up_fails_when_the_primary_is_unreachable(replicas, primary):
+    primary.reachable = False
+    with pytest.raises(OSError):
+        await warm_up_pool(4)
+
+
+@pytest.mark.anyio
+async def test_primary_check_follows_the_primary(primary):
+    assert await primary_is_up(timeout=1)
+    primary.reachable = False
+    assert not await primary_is_up(timeout=1)
@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight
+
+pytestmark = pytest.mark.anyio
+
+
+class Call:
+    """An awaitable call that runs until released, counting how often it ran."""
+
+    def __init__(self, result=None, error: Exception | None = None):
+        self.result = result
+        self.error = error
+        self.runs = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.runs += 1
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+async def test_concurrent_callers_share_one_call():
+    flights = SingleFlight()
+    call = Call(result="row")
+    tasks = [asyncio.create_task(flights.do("user", call)) for _ in range(20)]
+    await asyncio.sleep(0)
+    call.release.set()
+    results = await asyncio.gather(*tasks)
+
+    assert call.runs == 1
+    assert [result for result, _ in results] == ["row"] * 20
+    assert sorted(shared for _, shared in results) == [False] + [True] * 19
+    assert flights.stats() == {"calls": 1, "coalesced": 19, "in_flight": 0}
+
+
+async def test_different_keys_do_not_share():
+    flights = SingleFlight()
+    call = Call(result="row")
+    call.release.set()
+    await asyncio.gather(flights.do("a", call), flights.do("b", call))
+    assert call.runs == 2
+
+
+async def test_later_callers_start_a_new_call():
+    flights = SingleFlight()
+    call = Call(result="row")
+    call.release.set()
+    await flights.do("user", call)
+    await flights.do("user", call)
+    assert call.runs == 2
+
+
+async def test_exceptions_are_shared():
+    flights = SingleFlight()
+    call = Call(error=LookupError("gone"))
+    tasks = [asyncio.create_task(flights.do("user", call)) for _ in range(5)]
+    await asyncio.sleep(0)
+    call.release.set()
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    assert call.runs == 1
+    assert all(isinstance(result, LookupError) for result in results)
+    assert len(flights) == 0
+
+
+async def test_waiters_start_over_when_the_runner_is_cancelled():
+    flights = SingleFlight()
+    call = Call(result="row")
+    runner = asyncio.create_task(flights.do("user", call))
+    await asyncio.sleep(0)
+    waiters = [asyncio.create_task(flights.do("user", call)) for _ in range(3)]
+    await asyncio.sleep(0)
+
+    runner.cancel()
+    while call.runs < 2:  # a waiter has started the call over
+        await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    call.release.set()
+    results = await asyncio.gather(*waiters)
+
+    assert runner.cancelled()
+    assert call.runs == 2  # the cancelled run and the one a waiter started over with
+    assert [result for result, _ in results] == ["row"] * 3
+
+
+async def test_a_cancelled_waiter_does_not_cancel_the_call():
+    flights = SingleFlight()
+    call = Call(result="row")
+    runner = asyncio.create_task(flights.do("user", call))
+    await asyncio.sleep(0)
+    waiter = asyncio.create_task(flights.do("user", call))
+    await asyncio.sleep(0)
+
+    waiter.cancel()
+    await asyncio.sleep(0)
+    call.release.set()
+
+    assert await runner == ("row", False)
+    assert waiter.cancelled()
+    assert call.runs == 1
@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from repositories import models, postgres_repository
+from repositories.postgres_repository import STALE_USERS, WROTE, UserRepository
+
+pytestmark = pytest.mark.anyio
+
+USER_ID = "6f1c1d0e-3b0a-4c55-9d51-7b8f2a3a4f10"
+
+
+class Result:
+    def __init__(self, row):
+        self.row = row
+
+    def scalar_one_or_none(self):
+        return self.row
+
+
+class FakeSession:
+    """Just enough of AsyncSession for UserRepository reads; every session counts into ``queries``."""
+
+    def __init__(self, queries: list):
+        self.queries = queries
+        self.info = {}
+        self.new, self.dirty, self.deleted = set(), set(), set()
+
+    async def execute(self, query, bind_arguments=None):
+        self.queries.append(query)
+        await asyncio.sleep(0.01)  # long enough for every concurrent caller to arrive
+        return Result(models.User(user_id=USER_ID, login="vasya", password="x", name="Vasya", surname="Pupkin",
+                                  has_face_id=False, is_active=True, token_version=0))
+
+
+@pytest.fixture(autouse=True)
+def no_user_cache(monkeypatch):
+    monkeypatch.setattr(postgres_repository, "user_cache", None)
+
+
+async def test_concurrent_lookups_of_one_user_run_one_query():
+    queries = []
+    users = await asyncio.gather(*(UserRepository(FakeSession(queries)).get(USER_ID) for _ in range(20)))
+
+    assert len(queries) == 1
+    assert len({id(user) for user in users}) == 20  # followers get copies, not the runner's row
+    assert {(user.user_id, user.login) for user in users} == {(USER_ID, "vasya")}
+
+
+async def test_lookups_by_login_are_coalesced_too():
+    queries = []
+    await asyncio.gather(*(UserRepository(FakeSession(queries)).get_user_by_login("vasya") for _ in range(5)))
+    assert len(queries) == 1
+
+
+@pytest.mark.parametrize("prepare", [
+    lambda session: session.info.update({WROTE: True}),
+    lambda session: session.info.update({STALE_USERS: {USER_ID}}),
+    lambda session: session.new.add(object()),
+    lambda session: session.dirty.add(object()),
+], ids=["wrote", "stale", "pending new", "pending dirty"])
+async def test_sessions_with_own_writes_do_not_share_a_lookup(prepare):
+    queries = []
+    writer = FakeSession(queries)
+    prepare(writer)
+    await asyncio.gather(UserRepository(FakeSession(queries)).get(USER_ID), UserRepository(writer).get(USER_ID))
+    assert len(queries) == 2